@@ -3,11 +3,28 @@ calculator_cfg.py
 
 Usage:
     python calculator_cfg.py "1+2*3"
+    python calculator_cfg.py --batch expressions.txt [--cache-size 10000] [--jobs 4]
 
 This script builds an AST using Lark and then evaluates it recursively.
+The parse tables are cached by Lark in the temp directory, keyed by the
+grammar, so only the first run after grammar.lark changes builds them.
+
+--batch reads one expression per line from a file (or - for stdin) and
+prints each result as soon as it is computed, or "Error: ..." for a line
+that fails. Each expression is compiled once into a Python function, with
+constant subexpressions folded, and kept in an LRU cache keyed by its text,
+so repeated lines are not parsed again. --jobs splits the lines among
+worker processes. The number of expressions per second goes to stderr.
 """
+import argparse
+import functools
+import multiprocessing
+import operator
+import os
 import sys
 import math
+import time
+from itertools import islice
 from lark import Lark, Transformer
 
 class ASTCreator(Transformer):
@@ -25,43 +42,168 @@ class ASTCreator(Transformer):
         return('exp', items[0], items[1])
     def num(self, items):
         return('num', int(items[0]))
+    def var(self, items):
+        return('var', str(items[0]))
     
-def evaluate(ast):
+# variables maps the names in the expression to their values
+def evaluate(ast, variables=None):
     if ast[0] == 'plus':
-        return evaluate(ast[1]) + evaluate(ast[2])
+        return evaluate(ast[1], variables) + evaluate(ast[2], variables)
     elif ast[0] == 'sub':
-        return evaluate(ast[1]) - evaluate(ast[2])
+        return evaluate(ast[1], variables) - evaluate(ast[2], variables)
     elif ast[0] == 'mul':
-        return evaluate(ast[1]) * evaluate(ast[2])
+        return evaluate(ast[1], variables) * evaluate(ast[2], variables)
     elif ast[0] == 'neg':
-        return evaluate(ast[1]) * -1
+        return evaluate(ast[1], variables) * -1
     elif ast[0] == 'log':
-        return math.log(evaluate(ast[1]), evaluate(ast[2]))
+        return math.log(evaluate(ast[1], variables), evaluate(ast[2], variables))
     elif ast[0] == 'exp':
-        return evaluate(ast[1]) ** evaluate(ast[2])
+        return evaluate(ast[1], variables) ** evaluate(ast[2], variables)
     elif ast[0] == 'num':
         return ast[1]
+    elif ast[0] == 'var':
+        if variables is None or ast[1] not in variables:
+            raise ValueError(f"Unbound variable: {ast[1]}")
+        return variables[ast[1]]
     else:
         raise ValueError(f"Unknown operation: {ast}")
     
+GRAMMAR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "grammar.lark")
+
 def createParser():
-    with open("grammar.lark", "r") as grammar_file:
+    with open(GRAMMAR_PATH, "r") as grammar_file:
         grammar = grammar_file.read()
 
-    return Lark(grammar, parser='lalr')
+    return Lark(grammar, parser='lalr', cache=True)
+
+# evaluate the subexpressions without variables now, keeping those that
+# fail so that they raise the same error when the expression is run
+def fold(ast):
+    if ast[0] in ('num', 'var'):
+        return ast
+    node = (ast[0],) + tuple([fold(child) for child in ast[1:]])
+    if all(child[0] == 'num' for child in node[1:]):
+        try:
+            return ('num', evaluate(node))
+        except (ArithmeticError, ValueError):
+            pass
+    return node
+
+OPERATIONS = {
+    'plus': operator.add,
+    'sub': operator.sub,
+    'mul': operator.mul,
+    'log': math.log,
+    'exp': operator.pow,
+}
+
+# a function of the variables computing the same value as evaluate(ast, variables)
+def compile_ast(ast):
+    return compile_folded(fold(ast))
+
+def compile_folded(ast):
+    if ast[0] in OPERATIONS:
+        operation = OPERATIONS[ast[0]]
+        left, right = compile_folded(ast[1]), compile_folded(ast[2])
+        return lambda variables: operation(left(variables), right(variables))
+    elif ast[0] == 'neg':
+        operand = compile_folded(ast[1])
+        return lambda variables: operand(variables) * -1
+    elif ast[0] == 'num':
+        value = ast[1]
+        return lambda variables: value
+    elif ast[0] == 'var':
+        node = ast
+        return lambda variables: evaluate(node, variables)
+    else:
+        raise ValueError(f"Unknown operation: {ast}")
+
+# Evaluates lines of expressions one after the other. Each process running
+# a batch builds its own parser and cache.
+class BatchEvaluator:
+    def __init__(self, cache_size):
+        self.parser = createParser()
+        self.ast_creator = ASTCreator()
+        self.compiled = functools.lru_cache(maxsize=cache_size)(self.compile_text)
+
+    def compile_text(self, text):
+        return compile_ast(self.ast_creator.transform(self.parser.parse(text)))
+
+    def run(self, line):
+        text = line.strip()
+        if not text:
+            return ""
+        try:
+            return str(self.compiled(text)(None))
+        except Exception as e:
+            return f"Error: {type(e).__name__}: {e}".splitlines()[0]
+
+    def run_lines(self, lines):
+        return [self.run(line) for line in lines]
+
+batch_evaluator = None
+
+def init_worker(cache_size):
+    global batch_evaluator
+    batch_evaluator = BatchEvaluator(cache_size)
+
+def run_chunk(lines):
+    return batch_evaluator.run_lines(lines)
+
+def chunks(infile, size):
+    while True:
+        lines = list(islice(infile, size))
+        if not lines:
+            return
+        yield lines
+
+# yields the result of every line of infile, in order
+def run_batch(infile, cache_size=10000, jobs=1, chunk_size=1000):
+    if jobs <= 1:
+        evaluator = BatchEvaluator(cache_size)
+        for line in infile:
+            yield evaluator.run(line)
+        return
+    with multiprocessing.Pool(jobs, initializer=init_worker, initargs=(cache_size,)) as pool:
+        for results in pool.imap(run_chunk, chunks(infile, chunk_size)):
+            yield from results
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python calculator_cfg.py <expression>")
-        sys.exit(1)
-
-    ast_creator = ASTCreator()
-    parser = createParser()
-    expression = sys.argv[1]
-    tree = parser.parse(expression)
-    ast = ast_creator.transform(tree)
-    result = evaluate(ast)
-    print(result)
+    arg_parser = argparse.ArgumentParser(description="Evaluate arithmetic expressions.")
+    arg_parser.add_argument("expression", nargs="?")
+    arg_parser.add_argument("--batch", metavar="FILE", help="evaluate every line of FILE (- for stdin)")
+    arg_parser.add_argument("--cache-size", type=int, default=10000, help="compiled expressions kept by --batch")
+    arg_parser.add_argument("--jobs", type=int, default=1,
+                            help="worker processes for --batch (0 for one per core)")
+    args = arg_parser.parse_args()
+
+    if args.batch is None:
+        if args.expression is None:
+            print("Usage: python calculator_cfg.py <expression>")
+            sys.exit(1)
+        ast_creator = ASTCreator()
+        parser = createParser()
+        expression = args.expression
+        tree = parser.parse(expression)
+        ast = ast_creator.transform(tree)
+        result = evaluate(ast)
+        print(result)
+        return
+
+    jobs = args.jobs or os.cpu_count()
+    infile = sys.stdin if args.batch == '-' else open(args.batch)
+    start = time.perf_counter()
+    count = 0
+    try:
+        for result in run_batch(infile, args.cache_size, jobs):
+            print(result)
+            count += 1
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+    elapsed = time.perf_counter() - start
+    print(f"{count} expressions in {elapsed:.3f} s ({count / elapsed if elapsed else 0:.0f} expressions/s)",
+          file=sys.stderr)
     
 if __name__ == "__main__":
     main()
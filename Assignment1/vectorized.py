@@ -0,0 +1,170 @@
+"""
+vectorized.py
+
+Usage:
+    python vectorized.py "x*2 + log y base 10" data.csv [-o results.txt] [--chunk-size 100000]
+
+Evaluates one expression over every row of a CSV file whose header names the
+columns; the variables in the expression are columns. The expression is
+parsed once and compiled into NumPy operations, each applied to a whole
+column at a time. The file is read --chunk-size rows at a time, so it can be
+larger than memory; the results are written one per line, in row order.
+
+evaluate_columns(ast, columns) does the same for arrays already in memory.
+
+Every value is a float64, so results match calculator_cfg.evaluate() as far
+as float precision goes (its ints are exact at any size). Where evaluate()
+raises an error, such as for log 0 base 2, evaluate_columns() raises
+FloatingPointError instead of producing nan or inf. evaluate_csv() gives nan
+for such a row, so the rows around it are still evaluated and the stream
+goes on. An empty file has no rows and gives no results.
+"""
+import argparse
+import csv
+import sys
+from itertools import islice
+
+import numpy as np
+
+from calculator_cfg import ASTCreator, createParser
+
+
+def compile_expression(ast):
+    if ast[0] == 'plus':
+        left, right = compile_expression(ast[1]), compile_expression(ast[2])
+        return lambda columns: np.add(left(columns), right(columns))
+    elif ast[0] == 'sub':
+        left, right = compile_expression(ast[1]), compile_expression(ast[2])
+        return lambda columns: np.subtract(left(columns), right(columns))
+    elif ast[0] == 'mul':
+        left, right = compile_expression(ast[1]), compile_expression(ast[2])
+        return lambda columns: np.multiply(left(columns), right(columns))
+    elif ast[0] == 'neg':
+        operand = compile_expression(ast[1])
+        return lambda columns: np.negative(operand(columns))
+    elif ast[0] == 'log':
+        value, base = compile_expression(ast[1]), compile_expression(ast[2])
+        return lambda columns: np.divide(np.log(value(columns)), np.log(base(columns)))
+    elif ast[0] == 'exp':
+        base, power = compile_expression(ast[1]), compile_expression(ast[2])
+        return lambda columns: np.power(base(columns), power(columns))
+    elif ast[0] == 'num':
+        value = np.float64(ast[1])
+        return lambda columns: value
+    elif ast[0] == 'var':
+        name = ast[1]
+        return lambda columns: columns[name]
+    else:
+        raise ValueError(f"Unknown operation: {ast}")
+
+
+def variable_names(ast):
+    if ast[0] == 'var':
+        return {ast[1]}
+    if ast[0] == 'num':
+        return set()
+    return set().union(*[variable_names(child) for child in ast[1:]])
+
+
+# apply a compiled expression to columns of length rows; an expression with
+# no variables gives the same value for every row
+def run_compiled(function, columns, rows):
+    with np.errstate(divide='raise', invalid='raise', over='raise'):
+        result = function(columns)
+    return np.broadcast_to(result, (rows,))
+
+
+# The result has one value per row of columns, including columns the
+# expression does not use, so a constant expression is repeated for every
+# row. rows gives the number of rows when there are no columns (default 1).
+def evaluate_columns(ast, columns, rows=None):
+    names = variable_names(ast)
+    missing = names - set(columns)
+    if missing:
+        raise ValueError(f"Unbound variable: {sorted(missing)[0]}")
+    lengths = {len(column) for column in columns.values()}
+    if rows is not None:
+        lengths.add(rows)
+    if len(lengths) > 1:
+        raise ValueError(f"Columns of different lengths: {sorted(lengths)}")
+    rows = lengths.pop() if lengths else 1
+    arrays = {name: np.asarray(columns[name], dtype=np.float64) for name in names}
+    return run_compiled(compile_expression(ast), arrays, rows)
+
+
+# run_compiled(), except that a row whose evaluation fails gives nan rather
+# than failing all of them: a part of the rows that fails is split in two
+# until the rows that fail are found. Without columns every row fails alike.
+def run_rows(function, columns, rows):
+    result = np.empty(rows)
+    pending = [(0, rows)]
+    while pending:
+        start, stop = pending.pop()
+        part = {name: column[start:stop] for name, column in columns.items()}
+        try:
+            result[start:stop] = run_compiled(function, part, stop - start)
+        except FloatingPointError:
+            if stop - start == 1 or not columns:
+                result[start:stop] = np.nan
+            else:
+                middle = (start + stop) // 2
+                pending += [(start, middle), (middle, stop)]
+    return result
+
+
+# Yields the results for infile (CSV with a header), chunk_size rows at a
+# time; the header and the rows are read by the same csv reader. Only the
+# columns the expression uses are converted.
+def evaluate_csv(ast, infile, chunk_size=100000):
+    reader = csv.reader(infile)
+    header = next(reader, None)
+    if header is None:
+        return
+    header = [name.strip() for name in header]
+    names = variable_names(ast)
+    missing = names - set(header)
+    if missing:
+        raise ValueError(f"No column for variable: {sorted(missing)[0]}")
+    used = sorted(names, key=header.index)
+    indices = [header.index(name) for name in used]
+    function = compile_expression(ast)
+    while True:
+        rows = list(islice(reader, chunk_size))
+        if not rows:
+            break
+        # a blank line is an empty row, or one field of spaces
+        rows = [row for row in rows if len(row) > 1 or row and row[0].strip()]
+        if not rows:
+            continue
+        try:
+            columns = {name: np.array([row[i] for row in rows], dtype=np.float64)
+                       for name, i in zip(used, indices)}
+        except IndexError:
+            short = next(row for row in rows if len(row) <= max(indices))
+            raise ValueError(f"Row with {len(short)} fields, {len(header)} expected: {short}") from None
+        yield run_rows(function, columns, len(rows))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Evaluate an expression over the rows of a CSV file.")
+    arg_parser.add_argument("expression")
+    arg_parser.add_argument("csv", help="CSV file with a header row, or - for stdin")
+    arg_parser.add_argument("-o", "--output", help="file for the results (default stdout)")
+    arg_parser.add_argument("--chunk-size", type=int, default=100000, help="rows read at a time")
+    args = arg_parser.parse_args()
+
+    ast = ASTCreator().transform(createParser().parse(args.expression))
+    infile = sys.stdin if args.csv == '-' else open(args.csv, newline='')
+    outfile = sys.stdout if args.output is None else open(args.output, 'w')
+    try:
+        for results in evaluate_csv(ast, infile, args.chunk_size):
+            outfile.write("".join([repr(value) + "\n" for value in results.tolist()]))
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+
+
+if __name__ == "__main__":
+    main()
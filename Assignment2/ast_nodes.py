@@ -0,0 +1,77 @@
+"""
+ast_nodes.py
+
+Hash-consed AST nodes. mk(tag, *fields) returns the one shared Node for that
+structure, so structurally equal terms are always the same object: comparing
+two nodes is an identity check, and every node carries its hash, size and
+depth, computed once when it is created. The intern table only holds weak
+references, so nodes that are no longer used anywhere are freed as usual.
+
+`free` is left for the interpreter to cache the free variable names of a
+node in, and `created` counts the nodes mk() has actually allocated.
+
+Assignment3 has its own copy of this module, with the fields its nameless
+terms need instead of `free`. The copies stay local because the interpreter
+imports this module as it loads, and each assignment directory has to run on
+its own, with nothing to set up beforehand. server.py can be shared from the
+repository root because it is only loaded for --server.
+"""
+import math
+import weakref
+
+
+class Node(list):
+    # a list rather than a tuple only because tuple subclasses cannot be
+    # weakly referenced; a Node is never modified after mk() creates it
+    __slots__ = ("hash", "size", "depth", "free", "__weakref__")
+
+    __eq__ = object.__eq__
+    __ne__ = object.__ne__
+
+    def __hash__(self):
+        return self.hash
+
+    def __repr__(self):
+        return "mk" + repr(tuple(self))
+
+
+# intern key -> weak reference to the node. Child nodes are keyed by id():
+# a child cannot be freed (and its id reused) while the parent's entry is
+# still in the table, because the parent holds on to it.
+interned = {}
+created = 0
+
+
+def field_key(field):
+    if type(field) is Node:
+        return id(field)
+    if type(field) is str:
+        return field
+    if type(field) is float:
+        # keep 1 and 1.0 apart, and 0.0 and -0.0 as well
+        return (float, field, math.copysign(1.0, field))
+    return (type(field), field)
+
+
+def forget(ref):
+    if interned.get(ref.key) is ref:
+        del interned[ref.key]
+
+
+def mk(tag, *fields):
+    global created
+    key = (tag,) + tuple([id(field) if type(field) is Node else field_key(field) for field in fields])
+    ref = interned.get(key)
+    if ref is not None:
+        node = ref()
+        if node is not None:
+            return node
+    node = Node((tag,) + fields)
+    node.hash = hash(key)
+    children = [field for field in fields if type(field) is Node]
+    node.size = 1 + sum([child.size for child in children])
+    node.depth = 1 + max([child.depth for child in children], default=0)
+    node.free = None
+    created += 1
+    interned[key] = weakref.KeyedRef(node, forget, key)
+    return node
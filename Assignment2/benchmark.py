@@ -0,0 +1,130 @@
+"""
+benchmark.py
+
+Usage:
+    python benchmark.py engines [--engines reduce nbe es] [--repeat 3]
+    python benchmark.py strategies [--strategies nf whnf hnf cbv] [--repeat 3]
+    python benchmark.py church [--repeat 3]
+
+engines runs K-combinator-heavy and Church-numeral programs through each
+engine of interpret() and prints the reduction steps, the AST nodes
+allocated (Stats.nodes) and the best evaluation time of --repeat runs. A
+program that needs more Python stack than an engine allows is reported as
+RecursionError.
+
+strategies runs the same programs through the reduce engine with each
+evaluation strategy and prints the steps and the best evaluation time.
+On one machine (steps, ms):
+
+    program            nf             whnf           hnf            cbv
+    K discard              2    0.1       2    0.0       2    0.0       2    0.0
+    K chain               59   18.0       1    0.0      59  127.4      59    5.0
+    K under lambda        45    1.8       1    1.6       3    1.4       1    1.9
+    church add 20 20       6    1.4       2    2.3       4    2.8       2    2.3
+    church mul 8 8        19    4.4       2    0.5       5    0.6       2    0.4
+    church 2^6           126   33.3       1    0.1      12    1.4       1    0.1
+    church 2^8           510  610.9       1    0.1      16    4.8       1    0.1
+
+hnf is slower than nf on K chain: it contracts the outermost K first, so
+every step copies the unreduced arguments inside it.
+
+church runs Church-numeral programs far too large for the other engines
+through the church engine, which has numerals and booleans built in.
+"""
+import argparse
+
+from interpreter import ENGINES, STRATEGIES, Stats, interpret
+
+
+def church(n):
+    return r"(\f.\x." + "f (" * n + "x" + ")" * n + ")"
+
+
+K = r"(\x.\y.x)"
+CHURCH_ADD = r"(\m.\n.\f.\x.m f (n f x))"
+CHURCH_MUL = r"(\m.\n.\f.m (n f))"
+CHURCH_TRUE = r"(\x.\y.x)"
+CHURCH_AND = r"(\p.\q.p q p)"
+CHURCH_ISZERO = r"(\n.n (\x.\a.\b.b) (\a.\b.a))"
+
+PROGRAMS = {
+    # K throwing away a large argument
+    "K discard": f"{K} a {church(40)}",
+    "K chain": "".join(f"{K} (" for _ in range(30)) + "a" + "".join(f" {church(10)})" for _ in range(30)),
+    "K under lambda": rf"(\k.\z.k z ({church(40)} (\w.w) z)) {K}",
+    "church add 20 20": f"{CHURCH_ADD} {church(20)} {church(20)}",
+    "church mul 8 8": f"{CHURCH_MUL} {church(8)} {church(8)}",
+    "church 2^6": f"{church(6)} {church(2)}",
+    "church 2^8": f"{church(8)} {church(2)}",
+}
+
+LARGE_PROGRAMS = {
+    "church mul 100 100": f"{CHURCH_MUL} {church(100)} {church(100)}",
+    "church add 1000 1000": f"{CHURCH_ADD} {church(1000)} {church(1000)}",
+    "church 2^16": f"{church(16)} {church(2)}",
+    # a numeral applied to an application that only reduces to one
+    "church (2^3)^3": f"{church(3)} ({church(3)} {church(2)})",
+    "booleans": f"{CHURCH_AND} ({CHURCH_ISZERO} ({CHURCH_MUL} {church(50)} {church(0)})) {CHURCH_TRUE}",
+}
+
+
+def run(source, engine, repeat, strategy='nf'):
+    best = None
+    for _ in range(repeat):
+        stats = Stats()
+        interpret(source, stats=stats, engine=engine, strategy=strategy)
+        seconds = stats.seconds['evaluate']
+        best = seconds if best is None else min(best, seconds)
+    return stats, best
+
+
+def bench_engines(engines, repeat):
+    print(f"{'program':<18} {'engine':<8} {'steps':>8} {'nodes':>8} {'time':>11}")
+    for name, source in PROGRAMS.items():
+        for engine in engines:
+            try:
+                stats, seconds = run(source, engine, repeat)
+            except RecursionError:
+                print(f"{name:<18} {engine:<8} RecursionError")
+                continue
+            print(f"{name:<18} {engine:<8} {stats.steps:>8} {stats.nodes:>8} {seconds * 1000:8.2f} ms")
+
+
+def bench_strategies(strategies, repeat):
+    print(f"{'program':<18} {'strategy':<8} {'steps':>8} {'time':>11}")
+    for name, source in PROGRAMS.items():
+        for strategy in strategies:
+            stats, seconds = run(source, 'reduce', repeat, strategy)
+            print(f"{name:<18} {strategy:<8} {stats.steps:>8} {seconds * 1000:8.2f} ms")
+
+
+def bench_church(repeat):
+    print(f"{'program':<22} {'steps':>8} {'time':>11}")
+    for name, source in LARGE_PROGRAMS.items():
+        stats, seconds = run(source, 'church', repeat)
+        print(f"{name:<22} {stats.steps:>8} {seconds * 1000:8.2f} ms")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmarks for the Assignment2 interpreter.")
+    sub = arg_parser.add_subparsers(dest="command", required=True)
+    engines = sub.add_parser("engines", help="steps, allocated nodes and time of each engine")
+    engines.add_argument("--engines", choices=ENGINES, nargs="+", default=list(ENGINES))
+    engines.add_argument("--repeat", type=int, default=3)
+    strategies = sub.add_parser("strategies", help="steps and time of each evaluation strategy")
+    strategies.add_argument("--strategies", choices=STRATEGIES, nargs="+", default=list(STRATEGIES))
+    strategies.add_argument("--repeat", type=int, default=3)
+    church_cmd = sub.add_parser("church", help="large Church-numeral programs with the church engine")
+    church_cmd.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    if args.command == "engines":
+        bench_engines(args.engines, args.repeat)
+    elif args.command == "strategies":
+        bench_strategies(args.strategies, args.repeat)
+    elif args.command == "church":
+        bench_church(args.repeat)
+
+
+if __name__ == "__main__":
+    main()
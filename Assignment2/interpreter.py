@@ -1,83 +1,860 @@
 import sys
 from lark import Lark, Transformer, Tree
 import lark
+import argparse
+import importlib.util
+import json
 import os
+import time
+import ast_nodes
+from ast_nodes import mk
 
 #  run/execute/interpret source code
-def interpret(source_code):
-    cst = parser.parse(source_code)
-    ast = LambdaCalculusTransformer().transform(cst)
-    result_ast = evaluate(ast)
+#  (max_steps and max_size are the limits of evaluate(); see Stats for stats;
+#  engine is one of ENGINES; strategy is one of STRATEGIES, for the reduce engine)
+def interpret(source_code, max_steps=None, max_size=None, stats=None, engine='reduce', strategy='nf'):
+    # fresh names start from Var1 again, as in a new process
+    name_generator.counter = 0
+    if stats is not None:
+        return interpret_with_stats(source_code, max_steps, max_size, stats, engine, strategy)
+    ast = get_parser().parse(source_code)
+    result_ast = run_engine(ast, engine, max_steps, max_size, strategy=strategy)
     result = linearize(result_ast)
     return result
 
-# convert concrete syntax to CST
-parser = Lark(open("grammar.lark").read(), parser='lalr')
+# what an interpret() call did, filled in when it is passed as stats=
+class Stats:
+    def __init__(self):
+        self.steps = 0
+        # every step is a beta reduction (with nbe, a closure call; with
+        # church, a rule for numerals and booleans counts as one too)
+        self.beta = 0
+        self.substitute = 0  # with es, substitutions pushed down one node
+        self.fresh_names = 0
+        self.nodes = 0  # AST nodes allocated
+        self.peak_size = 0
+        self.peak_depth = 0
+        self.seconds = {}  # parse (which builds the AST), evaluate and linearize
+
+    def record(self, tree):
+        self.record_measures(tree.size, tree.depth)
+
+    # record() for a term that is not built, of the given size and depth
+    def record_measures(self, size, depth):
+        if size > self.peak_size:
+            self.peak_size = size
+        if depth > self.peak_depth:
+            self.peak_depth = depth
+
+    def as_dict(self):
+        return dict(vars(self))
+
+# stats is passed down to the engines, which count steps and substitute()
+# calls into it; fresh names and nodes are how far the counters have moved
+def interpret_with_stats(source_code, max_steps, max_size, stats, engine='reduce', strategy='nf'):
+    counter_before = name_generator.counter
+    nodes_before = ast_nodes.created
+    try:
+        start = time.perf_counter()
+        ast = get_parser().parse(source_code)
+        stats.seconds['parse'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            result_ast = run_engine(ast, engine, max_steps, max_size, stats, strategy)
+        finally:
+            stats.seconds['evaluate'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = linearize(result_ast)
+        stats.seconds['linearize'] = time.perf_counter() - start
+    finally:
+        stats.fresh_names += name_generator.counter - counter_before
+        stats.nodes += ast_nodes.created - nodes_before
+    return result
+
+def run_engine(ast, engine, max_steps=None, max_size=None, stats=None, strategy='nf'):
+    if strategy not in STRATEGIES:
+        raise ValueError('Unknown strategy: ' + str(strategy))
+    if strategy == 'nf':
+        return ENGINES[engine](ast, max_steps, max_size, stats)
+    if engine != 'reduce':
+        raise ValueError('a strategy other than nf needs the reduce engine')
+    return evaluate(ast, max_steps, max_size, stats, strategy)
+
+# convert concrete syntax to AST
+# the parser is built on first use; Lark caches its tables in the temp
+# directory, keyed by the grammar, so later runs just load them. The
+# transformer is applied while parsing, so no CST is built.
+GRAMMAR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "grammar.lark")
+# server.py is shared by both interpreters and lives one directory up
+SERVER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server.py")
+parser = None
 
-# convert CST to AST
+def get_parser():
+    global parser
+    if parser is None:
+        with open(GRAMMAR_PATH) as f:
+            parser = Lark(f.read(), parser='lalr', cache=True,
+                          transformer=LambdaCalculusTransformer())
+    return parser
+
+# build the AST nodes for the parser
 class LambdaCalculusTransformer(Transformer):
     def lam(self, args):
         name, body = args
-        return ('lam', str(name), body)
+        return mk('lam', str(name), body)
 
     def app(self, args):
-        return ('app', *args)
+        return mk('app', *args)
 
     def var(self, args):
         token, = args
-        return ('var', str(token))
+        return mk('var', str(token))
 
     def NAME(self, token):
         return str(token)
 
+# raised by evaluate() when a limit is hit; term is how far it got
+class LimitExceeded(Exception):
+    def __init__(self, message, term, steps):
+        super().__init__(message)
+        self.term = term
+        self.steps = steps
+        self.size = term.size
+
+class StepLimitExceeded(LimitExceeded):
+    pass
+
+class SizeLimitExceeded(LimitExceeded):
+    pass
+
 # reduce AST to normal form (normal-order, fully normalizing)
-def evaluate(tree):
-    # Keep reducing until no more changes occur (normal form)
+# max_steps: the most reduction steps to take
+# max_size: the most nodes the term may grow to
+# stats: records every step, if given
+# strategy: one of STRATEGIES; all but 'nf' are run by StrategyReducer below
+def evaluate(tree, max_steps=None, max_size=None, stats=None, strategy='nf'):
+    if strategy != 'nf':
+        return StrategyReducer(strategy, max_steps, max_size, stats).run(tree)
+    # Normal order: the search goes down lambda bodies and functions to the
+    # leftmost outermost redex, and reduces an argument only once the function
+    # it is applied to cannot reduce further. After a step it carries on from
+    # the subterm that changed instead of starting again at the root:
+    # everything to its left is already in normal form, and its ancestors are
+    # still waiting for it. So each ancestor is rebuilt once, when the search
+    # leaves it, and not after every step below it.
+    steps = 0
+    size = tree.size
+    if stats is not None:
+        stats.record(tree)
+    path = []  # (ancestor, position of the child being reduced)
+    # with stats, how deep the term goes beside the path, for each entry of it
+    beside = [] if stats is not None else None
+    node = tree
     while True:
-        new_tree = reduce_once(tree)
-        if new_tree == tree:
-            return tree  # normal form reached
-        tree = new_tree
+        # go down to the leftmost subterm: a lambda's body, a function
+        while node[0] != 'var':
+            position = 2 if node[0] == 'lam' else 1
+            if beside is not None:
+                beside.append(depth_beside(node, position, len(path), beside[-1] if beside else 0))
+            path.append((node, position))
+            node = node[position]
 
-def reduce_once(tree):
-    # VAR
-    if tree[0] == 'var':
+        # node is in normal form: go back up until there is a step to take
+        while True:
+            if not path:
+                return node  # normal form reached
+            parent, position = path.pop()
+            if beside is not None:
+                beside.pop()
+            if parent[position] is not node:
+                fields = parent[:]
+                fields[position] = node
+                parent = mk(*fields)
+            if parent[0] == 'app' and position == 1:
+                if node[0] != 'lam':
+                    # reduce the argument only when the function cannot reduce further
+                    if beside is not None:
+                        beside.append(depth_beside(parent, 2, len(path), beside[-1] if beside else 0))
+                    path.append((parent, 2))
+                    node = parent[2]
+                    break
+                if max_steps is not None and steps == max_steps:
+                    raise StepLimitExceeded(f"no normal form after {steps} steps", plug(path, parent), steps)
+                steps += 1
+                node = substitute(node[2], node[1], parent[2], stats)
+                size += node.size - parent.size
+                if stats is not None:
+                    stats.steps += 1
+                    stats.beta += 1
+                    stats.record_measures(size, max(beside[-1] if beside else 0, len(path) + node.depth))
+                if max_size is not None and size > max_size:
+                    raise SizeLimitExceeded(f"term grew to {size} nodes after {steps} steps", plug(path, node), steps)
+                break
+            node = parent
+
+# the depth the term reaches beside the subterm at position in parent, given
+# the level of parent in the term and the depth reached above it
+def depth_beside(parent, position, level, above):
+    if parent[0] == 'app':
+        return max(above, level + 1 + parent[3 - position].depth)
+    return above
+
+# the whole term, with node put in the place the path of evaluate() leads to
+def plug(path, node):
+    for parent, position in reversed(path):
+        fields = parent[:]
+        fields[position] = node
+        node = mk(*fields)
+    return node
+
+# how far evaluate() reduces:
+#   nf    full normal form, under lambdas too (the default)
+#   whnf  weak head normal form: until the term is a lambda, or a variable
+#         applied to arguments, which are left as they are
+#   hnf   head normal form: whnf, then the same again under every lambda at
+#         the top
+#   cbv   call by value: as whnf, but the argument of an application is reduced
+#         (to a lambda, or a variable applied to arguments) before it is
+#         substituted
+STRATEGIES = ('nf', 'whnf', 'hnf', 'cbv')
+
+# Reduces a term with one of the strategies other than 'nf'. whnf unwinds the
+# spine of applications once and keeps the arguments on a stack, so every
+# step is taken right where the last one left off. max_size applies to the
+# term being reduced (with cbv, an argument is reduced on its own).
+class StrategyReducer:
+    def __init__(self, strategy, max_steps=None, max_size=None, stats=None):
+        if strategy not in STRATEGIES or strategy == 'nf':
+            raise ValueError('Unknown strategy: ' + str(strategy))
+        self.strategy = strategy
+        self.max_steps = max_steps
+        self.max_size = max_size
+        self.stats = stats
+        self.steps = 0
+
+    def run(self, tree):
+        if self.stats is not None:
+            self.stats.record(tree)
+        if self.strategy == 'whnf':
+            return self.whnf(tree)
+        if self.strategy == 'hnf':
+            return self.hnf(tree)
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, RECURSION_LIMIT))
+        try:
+            return self.cbv(tree)
+        finally:
+            sys.setrecursionlimit(limit)
+
+    # count a step that gave tree, applied to args (innermost last)
+    def count_step(self, tree, args=()):
+        if self.max_steps is not None and self.steps == self.max_steps:
+            raise StepLimitExceeded(f'no {self.strategy} result after {self.steps} steps',
+                                    apply_to(tree, args), self.steps)
+        self.steps += 1
+        if self.stats is not None:
+            self.stats.steps += 1
+            self.stats.beta += 1
+            self.stats.record(tree)
+        if self.max_size is not None:
+            size = tree.size + sum(arg.size + 1 for arg in args)
+            if size > self.max_size:
+                raise SizeLimitExceeded(f'term grew to {size} nodes after {self.steps} steps',
+                                        apply_to(tree, args), self.steps)
+
+    def whnf(self, tree):
+        args = []
+        while True:
+            if tree[0] == 'app':
+                args.append(tree[2])
+                tree = tree[1]
+            elif tree[0] == 'lam' and args:
+                tree = substitute(tree[2], tree[1], args.pop(), self.stats)
+                self.count_step(tree, args)
+            else:
+                return apply_to(tree, args)
+
+    def hnf(self, tree):
+        names = []
+        tree = self.whnf(tree)
+        while tree[0] == 'lam':
+            names.append(tree[1])
+            tree = self.whnf(tree[2])
+        for name in reversed(names):
+            tree = mk('lam', name, tree)
         return tree
 
-    # LAMBDA: reduce inside the body (needed for full normal form)
-    if tree[0] == 'lam':
-        name = tree[1]
-        body = tree[2]
-        reduced_body = reduce_once(body)
-        if reduced_body != body:
-            return ('lam', name, reduced_body)
+    def cbv(self, tree):
+        while tree[0] == 'app':
+            func, arg = self.cbv(tree[1]), self.cbv(tree[2])
+            if func[0] != 'lam':
+                return tree if func is tree[1] and arg is tree[2] else mk('app', func, arg)
+            tree = substitute(func[2], func[1], arg, self.stats)
+            self.count_step(tree)
         return tree
 
-    # APPLICATION
-    if tree[0] == 'app':
-        func = tree[1]
-        arg = tree[2]
+# func applied to args, the first argument last
+def apply_to(func, args):
+    for arg in reversed(args):
+        func = mk('app', func, arg)
+    return func
+
+
+# Normalization by evaluation, an alternative to evaluate() giving the same
+# normal form up to the names of bound variables: the term is evaluated into
+# Python values -- closures ('closure', name, body, env) and neutral terms
+# ('neutral', name, argument thunks), a free variable applied to arguments --
+# which are then read back into a term, going under a lambda by applying its
+# closure to a fresh neutral variable. Arguments are evaluated lazily and at
+# most once (thunks are lists [term, env], [None, value] once forced), so
+# anything normal order normalizes is normalized here too.
+#
+# An environment is None or (name, thunk, environment).
+class NbE:
+    def __init__(self, tree, max_steps=None, max_size=None):
+        self.tree = tree
+        self.max_steps = max_steps
+        self.max_size = max_size
+        self.steps = 0
+        self.free = free_names(tree)
+
+    def eval(self, tree, env):
+        while True:
+            if tree[0] == 'var':
+                thunk = lookup(env, tree[1])
+                if thunk is None:
+                    return ('neutral', tree[1], ())
+                return self.force(thunk)
+            if tree[0] == 'lam':
+                return ('closure', tree[1], tree[2], env)
+            if tree[0] == 'app':
+                func = self.eval(tree[1], env)
+                arg = self.delay(tree[2], env)
+                if func[0] == 'neutral':
+                    return ('neutral', func[1], func[2] + (arg,))
+                # a call in tail position continues the loop
+                self.count_step()
+                tree, env = func[2], (func[1], arg, func[3])
+                continue
+            raise Exception('Unknown tree', tree)
+
+    def apply(self, func, arg):
+        if func[0] == 'neutral':
+            return ('neutral', func[1], func[2] + (arg,))
+        self.count_step()
+        return self.eval(func[2], (func[1], arg, func[3]))
+
+    def count_step(self):
+        if self.max_steps is not None and self.steps == self.max_steps:
+            raise StepLimitExceeded(f"no normal form after {self.steps} steps", self.tree, self.steps)
+        self.steps += 1
+
+    # values are not terms, so the size limit is checked on the terms readback
+    # builds, each of them part of the normal form
+    def check_size(self, term):
+        if self.max_size is not None and term.size > self.max_size:
+            raise SizeLimitExceeded(f"term grew to {term.size} nodes after {self.steps} steps", term, self.steps)
+        return term
 
-        # normal order: reduce the function first
-        reduced_func = reduce_once(func)
-        if reduced_func != func:
-            return ('app', reduced_func, arg)
+    # variables pass on the thunk they already have, lambdas need no delaying
+    def delay(self, tree, env):
+        if tree[0] == 'var':
+            thunk = lookup(env, tree[1])
+            if thunk is not None:
+                return thunk
+        if tree[0] in ('var', 'lam'):
+            return [None, self.eval(tree, env)]
+        return [tree, env]
 
-        # If function is a lambda → β-reduction
-        if func[0] == 'lam':
-            name = func[1]
-            body = func[2]
-            return substitute(body, name, arg)
+    def force(self, thunk):
+        if thunk[0] is None:
+            return thunk[1]
+        value = self.eval(thunk[0], thunk[1])
+        thunk[0] = None
+        thunk[1] = value
+        return value
 
-        # Reduce the argument only when the function cannot reduce further
-        reduced_arg = reduce_once(arg)
-        if reduced_arg != arg:
-            return ('app', func, reduced_arg)
+    # scope holds the names of the lambdas around the value being read back;
+    # a lambda keeps its name unless that would capture a variable
+    def readback(self, value, scope):
+        if value[0] == 'closure':
+            name = value[1]
+            if name in scope or name in self.free:
+                name = name_generator.generate()
+            body = self.apply(value, [None, ('neutral', name, ())])
+            scope.add(name)
+            try:
+                return self.check_size(mk('lam', name, self.readback(body, scope)))
+            finally:
+                scope.discard(name)
+        term = mk('var', value[1])
+        for arg in value[2]:
+            term = self.check_size(mk('app', term, self.readback(self.force(arg), scope)))
+        return term
 
-        # No reduction possible
+def lookup(env, name):
+    while env is not None:
+        if env[0] == name:
+            return env[1]
+        env = env[2]
+    return None
+
+def free_names(tree):
+    names = set()
+    stack = [(tree, frozenset())]
+    while stack:
+        tree, bound = stack.pop()
+        if tree[0] == 'var':
+            if tree[1] not in bound:
+                names.add(tree[1])
+        elif tree[0] == 'lam':
+            stack.append((tree[2], bound | {tree[1]}))
+        else:
+            stack.append((tree[2], bound))
+            stack.append((tree[1], bound))
+    return names
+
+# Python stack frames allowed while normalizing by evaluation or with explicit
+# substitutions, which recurse as deep as the normal form is
+RECURSION_LIMIT = 100000
+
+# the normal form of tree by NbE, with the same arguments as evaluate(); a
+# step is a call of a closure, and max_size limits the normal form as it is
+# read back (evaluation builds no terms, so only max_steps stops a program
+# that never gets that far)
+def evaluate_nbe(tree, max_steps=None, max_size=None, stats=None):
+    nbe = NbE(tree, max_steps, max_size)
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, RECURSION_LIMIT))
+    try:
+        result = nbe.readback(nbe.eval(tree, None), set())
+    finally:
+        sys.setrecursionlimit(limit)
+        if stats is not None:
+            stats.steps += nbe.steps
+            stats.beta += nbe.steps
+    if stats is not None:
+        stats.record(tree)
+        stats.record(result)
+    if max_size is not None and result.size > max_size:
+        raise SizeLimitExceeded(f"normal form has {result.size} nodes", result, nbe.steps)
+    return result
+
+# Reduction with explicit substitutions, another alternative to evaluate():
+# a beta step only builds ('sub', body, name, replacement), standing for body
+# with replacement for name, and the substitution is pushed down one node at
+# a time when the reducer needs to see what is under it. A substitution for a
+# name that is not free in the term is dropped without looking inside, and a
+# lambda is only renamed if its name is free in the replacement, so the parts
+# of a term that are thrown away are never copied.
+#
+# Rather than searching the whole term for a redex at every step, the term is
+# reduced to weak head normal form and then normalized part by part, which
+# contracts the same redexes as normal order (leftmost outermost first).
+class ExplicitSubstitution:
+    def __init__(self, tree, max_steps=None, max_size=None):
+        self.tree = tree
+        self.max_steps = max_steps
+        self.max_size = max_size
+        self.steps = 0
+        self.beta = 0
+        self.pushes = 0
+
+    def count_step(self):
+        if self.max_steps is not None and self.steps == self.max_steps:
+            raise StepLimitExceeded(f"no normal form after {self.steps} steps", self.tree, self.steps)
+        self.steps += 1
+
+    # the term being reduced is part of the whole one, pending substitutions
+    # included, so it is checked after every step
+    def check_size(self, tree):
+        if self.max_size is not None and tree.size > self.max_size:
+            raise SizeLimitExceeded(f"term grew to {tree.size} nodes after {self.steps} steps", tree, self.steps)
         return tree
 
-    raise Exception('Unknown tree', tree)
+    def whnf(self, tree):
+        while True:
+            if tree[0] == 'sub':
+                self.count_step()
+                self.pushes += 1
+                tree = self.check_size(push(tree))
+            elif tree[0] == 'app':
+                func = self.whnf(tree[1])
+                if func[0] != 'lam':
+                    return tree if func is tree[1] else self.check_size(mk('app', func, tree[2]))
+                self.count_step()
+                self.beta += 1
+                tree = self.check_size(delay(func[2], func[1], tree[2]))
+            else:
+                return tree
+
+    def normalize(self, tree):
+        tree = self.whnf(tree)
+        if tree[0] == 'lam':
+            body = self.normalize(tree[2])
+            return tree if body is tree[2] else self.check_size(mk('lam', tree[1], body))
+        if tree[0] == 'app':
+            # the head is a variable, so both sides are part of the normal form
+            func, arg = self.normalize(tree[1]), self.normalize(tree[2])
+            return tree if func is tree[1] and arg is tree[2] else self.check_size(mk('app', func, arg))
+        return tree
+
+# the normal form of tree with explicit substitutions, with the same
+# arguments as evaluate(); max_size limits every term built while reducing
+# (the parts of the term whnf() and normalize() are still working on are held
+# by their callers, so max_steps is what stops a term growing among those)
+def evaluate_es(tree, max_steps=None, max_size=None, stats=None):
+    es = ExplicitSubstitution(tree, max_steps, max_size)
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, RECURSION_LIMIT))
+    try:
+        result = es.normalize(tree)
+    finally:
+        sys.setrecursionlimit(limit)
+        if stats is not None:
+            stats.steps += es.steps
+            stats.beta += es.beta
+            stats.substitute += es.pushes
+    if stats is not None:
+        stats.record(tree)
+        stats.record(result)
+    if max_size is not None and result.size > max_size:
+        raise SizeLimitExceeded(f"normal form has {result.size} nodes", result, es.steps)
+    return result
+
+# tree with replacement for name, as a delayed substitution if needed at all
+def delay(tree, name, replacement):
+    if name not in free_vars(tree):
+        return tree
+    if tree[0] == 'var':
+        return replacement
+    return mk('sub', tree, name, replacement)
+
+# one step of the substitution at the top of tree, a sub node
+def push(tree):
+    body, name, replacement = tree[1], tree[2], tree[3]
+    if body[0] == 'sub':
+        return mk('sub', push(body), name, replacement)
+    if body[0] == 'app':
+        return mk('app', delay(body[1], name, replacement), delay(body[2], name, replacement))
+    if body[0] == 'lam':
+        # the name is free in body, so it is not the lambda's own name
+        if body[1] not in free_vars(replacement):
+            return mk('lam', body[1], delay(body[2], name, replacement))
+        fresh_name = name_generator.generate()
+        renamed = delay(body[2], body[1], mk('var', fresh_name))
+        return mk('lam', fresh_name, delay(renamed, name, replacement))
+    return delay(body, name, replacement)
+
+# the names of the free variables of tree, computed once for every node
+def free_vars(tree):
+    if tree.free is not None:
+        return tree.free
+    stack = [tree]
+    while stack:
+        node = stack[-1]
+        children = [child for child in node[1:] if type(child) is not str and child.free is None]
+        if children:
+            stack.extend(children)
+            continue
+        stack.pop()
+        if node.free is not None:
+            continue
+        if node[0] == 'var':
+            node.free = frozenset((node[1],))
+        elif node[0] == 'lam':
+            node.free = node[2].free - {node[1]}
+        elif node[0] == 'app':
+            node.free = node[1].free | node[2].free
+        elif node[2] in node[1].free:
+            node.free = (node[1].free - {node[2]}) | node[3].free
+        else:
+            node.free = node[1].free
+    return tree.free
+
+# Church numerals and booleans, natively (the church engine). The standard
+# encodings are recognized in the parsed term and replaced by nodes standing
+# for them: ('num', n) for the numeral n, ('bool', b) for true and false and
+# ('prim', name, term) for the lambda term of one of CHURCH_PRIMITIVES. A
+# primitive applied to the numbers or booleans it needs is contracted in one
+# step, and so is a numeral applied to a numeral (n m is m to the power n) or
+# to two arguments, and a boolean choosing between two. Anywhere else such a
+# node is replaced by its lambda term and reduction goes on as in evaluate().
+# The numbers and booleans left in the normal form are printed as their lambda
+# terms by linearize(), so the result is the same as with evaluate() up to the
+# names of bound variables; false and 0 are the same term and are used for
+# one another.
+CHURCH_PRIMITIVES = {
+    'succ': [r'\n.\f.\x.f (n f x)', r'\n.\f.\x.n f (f x)'],
+    'add': [r'\m.\n.\f.\x.m f (n f x)'],
+    'mul': [r'\m.\n.\f.m (n f)', r'\m.\n.\f.\x.m (n f) x'],
+    'exp': [r'\m.\n.n m'],
+    'and': [r'\p.\q.p q p'],
+    'or': [r'\p.\q.p p q'],
+    'not': [r'\p.\a.\b.p b a'],
+    'iszero': [r'\n.n (\x.\a.\b.b) (\a.\b.a)'],
+}
+church_primitives = None
+
+# size -> {alpha_key(): (name, term)} for the terms in CHURCH_PRIMITIVES,
+# parsed on first use
+def get_church_primitives():
+    global church_primitives
+    if church_primitives is None:
+        church_primitives = {}
+        for name, sources in CHURCH_PRIMITIVES.items():
+            for source in sources:
+                term = get_parser().parse(source)
+                church_primitives.setdefault(term.size, {})[alpha_key(term)] = (name, term)
+    return church_primitives
+
+# tree with the names of bound variables replaced by how far out their lambda
+# is, so that terms equal up to renaming have equal keys
+def alpha_key(tree, scope=()):
+    if tree[0] == 'var':
+        return scope.index(tree[1]) if tree[1] in scope else tree[1]
+    if tree[0] == 'lam':
+        return ('lam', alpha_key(tree[2], (tree[1],) + scope))
+    return ('app', alpha_key(tree[1], scope), alpha_key(tree[2], scope))
+
+# the numeral or boolean tree is the lambda term of, or None
+def church_value(tree):
+    if tree[0] in ('num', 'bool'):
+        return tree
+    if tree[0] != 'lam' or tree[2][0] != 'lam':
+        return None
+    f, x, body = tree[1], tree[2][1], tree[2][2]
+    if body[0] == 'var' and body[1] == x:
+        return mk('num', 0)
+    if f == x:
+        return None
+    if body[0] == 'var' and body[1] == f:
+        return mk('bool', True)
+    n = 0
+    while body[0] == 'app' and body[1][0] == 'var' and body[1][1] == f:
+        n += 1
+        body = body[2]
+    if body[0] == 'var' and body[1] == x:
+        return mk('num', n)
+    return None
+
+def church_number(tree):
+    value = church_value(tree)
+    if value is None:
+        return None
+    return value[1] if value[0] == 'num' else 0 if value[1] is False else None
+
+def church_bool(tree):
+    value = church_value(tree)
+    if value is None:
+        return None
+    return value[1] if value[0] == 'bool' else False if value[1] == 0 else None
+
+# tree with every numeral, boolean and primitive in it replaced by its node;
+# done is the result for every node seen so far
+def recognize(tree, done):
+    if tree in done:
+        return done[tree]
+    result = church_value(tree)
+    candidates = get_church_primitives().get(tree.size)
+    if result is None and candidates and tree[0] == 'lam' and not free_vars(tree):
+        found = candidates.get(alpha_key(tree))
+        if found is not None:
+            result = mk('prim', found[0], tree)
+    if result is None and tree[0] == 'lam':
+        body = recognize(tree[2], done)
+        result = tree if body is tree[2] else mk('lam', tree[1], body)
+    if result is None and tree[0] == 'app':
+        func, arg = recognize(tree[1], done), recognize(tree[2], done)
+        result = tree if func is tree[1] and arg is tree[2] else mk('app', func, arg)
+    if result is None:
+        result = tree
+    done[tree] = result
+    return result
+
+# the lambda term a numeral, boolean or primitive node stands for
+def church_term(tree):
+    if tree[0] == 'prim':
+        return tree[2]
+    if tree[0] == 'bool':
+        return mk('lam', 'x', mk('lam', 'y', mk('var', 'x' if tree[1] else 'y')))
+    body = mk('var', 'x')
+    for _ in range(tree[1]):
+        body = mk('app', mk('var', 'f'), body)
+    return mk('lam', 'f', mk('lam', 'x', body))
+
+# The rule for head, a numeral, boolean or primitive node, applied to args
+# (the first argument last): the result, the index in args of an argument to
+# normalize before the rule can tell, or None if there is no rule to apply.
+# Only the arguments the lambda term of head would use first are reduced,
+# so nothing that evaluate() would throw away is evaluated.
+def church_rule(head, args):
+    if head[0] == 'num':
+        if len(args) >= 2:
+            result = args[-2]
+            for _ in range(head[1]):
+                result = mk('app', args[-1], result)
+            return apply_to(result, args[:-2])
+        if args and head[1] > 0:
+            # n m is m to the power n; n f applies f first
+            m = church_number(args[-1])
+            if m is None:
+                return len(args) - 1
+            return apply_to(mk('num', m ** head[1]), args[:-1])
+        return None
+    if head[0] == 'bool':
+        if len(args) >= 2:
+            return apply_to(args[-1] if head[1] else args[-2], args[:-2])
+        return None
+
+    name = head[1]
+    arity = 1 if name in ('succ', 'not', 'iszero') else 2
+    if len(args) < arity:
+        return None
+    first = args[-1]
+    rest = args[:-arity]
+    if name in ('and', 'or', 'not'):
+        p = church_bool(first)
+        if p is None:
+            return len(args) - 1
+        if name == 'not':
+            return apply_to(mk('bool', not p), rest)
+        if p == (name == 'or'):
+            return apply_to(mk('bool', p), rest)
+        return apply_to(args[-2], rest)
+
+    # exp m n is n m, so n is used first
+    m = church_number(first)
+    if name == 'exp':
+        n = church_number(args[-2])
+        if n is None:
+            return len(args) - 2
+        if n == 0 or m is None:
+            return None if n == 0 else len(args) - 1
+        return apply_to(mk('num', m ** n), rest)
+    if m is None:
+        return len(args) - 1
+    if name == 'succ':
+        return apply_to(mk('num', m + 1), rest)
+    if name == 'iszero':
+        return apply_to(mk('bool', m == 0), rest)
+    if name == 'mul' and m == 0:
+        return apply_to(mk('num', 0), rest)
+    n = church_number(args[-2])
+    if n is None:
+        return len(args) - 2
+    return apply_to(mk('num', m + n if name == 'add' else m * n), rest)
+
+# the head of tree and its arguments, the first argument last
+def spine(tree):
+    args = []
+    while tree[0] == 'app':
+        args.append(tree[2])
+        tree = tree[1]
+    return tree, args
+
+# the normal form of tree with Church numerals and booleans built in, with
+# the same arguments as evaluate(); a contraction by church_rule() counts as
+# one step. The search is evaluate()'s, with an application taken as a whole:
+# its head is contracted with its arguments, and when it cannot be, the
+# arguments are normalized from the first, or just the one church_rule()
+# asks for, and the rule is tried again. A step carries on where it was taken.
+def evaluate_church(tree, max_steps=None, max_size=None, stats=None):
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, RECURSION_LIMIT))
+    try:
+        tree = recognize(tree, {})
+        steps = 0
+        size = tree.size
+        if stats is not None:
+            stats.record(tree)
+        # per ancestor: (lambda, None, None), or (head, args, index) for the
+        # argument of an application being normalized
+        path = []
+        node = tree
+        new = None  # what node contracts to, if it does
+        while True:
+            if new is not None:
+                if max_steps is not None and steps == max_steps:
+                    raise StepLimitExceeded(f"no normal form after {steps} steps", church_plug(path, node), steps)
+                steps += 1
+                size += new.size - node.size
+                node, new = new, None
+                if stats is not None:
+                    stats.steps += 1
+                    stats.beta += 1
+                    stats.record(church_plug(path, node))
+                if max_size is not None and size > max_size:
+                    raise SizeLimitExceeded(f"term grew to {size} nodes after {steps} steps",
+                                            church_plug(path, node), steps)
+
+            if node[0] == 'prim':
+                new = church_term(node)
+                continue
+            if node[0] == 'lam':
+                path.append((node, None, None))
+                node = node[2]
+                continue
+            if node[0] == 'app':
+                head, args = spine(node)
+                if head[0] == 'lam':
+                    new = apply_to(substitute(head[2], head[1], args[-1], stats), args[:-1])
+                    continue
+                index = len(args) - 1
+                if head[0] != 'var':
+                    new = church_rule(head, args)
+                    if type(new) is not int:
+                        new = new if new is not None else apply_to(church_term(head), args)
+                        continue
+                    index, new = new, None
+                path.append((head, args, index))
+                node = args[index]
+                continue
+
+            # node is in normal form: go back up until there is more to do
+            while path:
+                head, args, index = path.pop()
+                if args is None:
+                    node = head if head[2] is node else mk('lam', head[1], node)
+                    continue
+                if args[index] is not node:
+                    args = args[:index] + [node] + args[index + 1:]
+                node = apply_to(head, args)
+                if head[0] == 'var':
+                    if index > 0:
+                        path.append((head, args, index - 1))
+                        node = args[index - 1]
+                        break
+                    continue
+                result = church_rule(head, args)
+                if type(result) is int and result != index:
+                    path.append((head, args, result))
+                    node = args[result]
+                elif result is None or type(result) is int:
+                    # no rule, or the argument is normal and still not what
+                    # the rule needs
+                    new = apply_to(church_term(head), args)
+                else:
+                    new = result
+                break
+            else:
+                return node
+    finally:
+        sys.setrecursionlimit(limit)
+
+# the whole term, with node put in the place the path of evaluate_church()
+# leads to
+def church_plug(path, node):
+    for head, args, index in reversed(path):
+        if args is None:
+            node = mk('lam', head[1], node)
+        else:
+            node = apply_to(head, args[:index] + [node] + args[index + 1:])
+    return node
+
+ENGINES = {'reduce': evaluate, 'nbe': evaluate_nbe, 'es': evaluate_es, 'church': evaluate_church}
 
 
 # generate a fresh name 
@@ -95,8 +872,11 @@ name_generator = NameGenerator()
 
 # for beta reduction (capture-avoiding substitution)
 # 'replacement' for 'name' in 'tree'
-def substitute(tree, name, replacement):
+# stats, if given, counts every call, the recursive ones too
+def substitute(tree, name, replacement, stats=None):
     # tree [replacement/name] = tree with all instances of 'name' replaced by 'replacement'
+    if stats is not None:
+        stats.substitute += 1
     if tree[0] == 'var':
         if tree[1] == name:
             return replacement # n [r/n] --> r
@@ -108,38 +888,100 @@ def substitute(tree, name, replacement):
             return tree # \n.e [r/n] --> \n.e
         else:
             fresh_name = name_generator.generate()
-            return ('lam',
+            return mk('lam',
                     fresh_name,
                     substitute(
-                        substitute(tree[2], tree[1], ('var', fresh_name)),
+                        substitute(tree[2], tree[1], mk('var', fresh_name), stats),
                         name,
-                        replacement
+                        replacement,
+                        stats
                     ))
             # \x.e [r/n] --> (\fresh.(e[fresh/x])) [r/n]
 
     elif tree[0] == 'app':
-        return ('app',
-                substitute(tree[1], name, replacement),
-                substitute(tree[2], name, replacement))
+        return mk('app',
+                substitute(tree[1], name, replacement, stats),
+                substitute(tree[2], name, replacement, stats))
+
+    elif tree[0] in ('num', 'bool', 'prim'):
+        return tree # the Church engine's nodes stand for closed terms
 
     else:
         raise Exception('Unknown tree', tree)
 
+# the pieces are printed from an explicit stack, so normal forms deeper than
+# the Python stack (such as large Church numerals) can be printed
 def linearize(ast):
-    if ast[0] == 'var':
-        return ast[1]
-    elif ast[0] == 'lam':
-        return "(" + "\\" + ast[1] + "." + linearize(ast[2]) + ")"
-    elif ast[0] == 'app':
-        return "(" + linearize(ast[1]) + " " + linearize(ast[2]) + ")"
-    else:
-        return ast
+    out = []
+    stack = [ast]
+    while stack:
+        item = stack.pop()
+        if type(item) is str:
+            out.append(item)
+        elif item[0] == 'var':
+            out.append(item[1])
+        elif item[0] == 'lam':
+            stack.extend((")", item[2], "(" + "\\" + item[1] + "."))
+        elif item[0] == 'app':
+            stack.extend((")", item[2], " ", item[1], "("))
+        elif item[0] == 'num':
+            # the Church numeral, written out only here
+            out.append("(\\f.(\\x." + "(f " * item[1] + "x" + ")" * item[1] + "))")
+        elif item[0] == 'bool':
+            out.append("(\\x.(\\y.x))" if item[1] else "(\\x.(\\y.y))")
+        else:
+            out.append(str(item))
+    return "".join(out)
+
+# server.py, loaded from SERVER_PATH when --server is given: importing this
+# module does not touch sys.path, and no other module named server can be
+# picked up in its place
+def load_server():
+    spec = importlib.util.spec_from_file_location('lambda_server', SERVER_PATH)
+    server = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(server)
+    return server
+
+def handle_request(request):
+    if request['engine'] not in ENGINES:
+        raise ValueError('Unknown engine: ' + str(request['engine']))
+    return interpret(request['program'], max_steps=request['max_steps'], max_size=request['max_size'],
+                     engine=request['engine'], strategy=request['strategy'])
 
 def main():
-    if len(sys.argv) != 2:
-        sys.exit(1)
+    arg_parser = argparse.ArgumentParser(description='Evaluate a lambda calculus term.')
+    arg_parser.add_argument('program', nargs='?', help='source code or the name of a file containing it')
+    arg_parser.add_argument('--engine', choices=ENGINES, default='reduce',
+                            help='reduce = normal-order reduction, nbe = normalization by evaluation, '
+                                 'es = reduction with explicit substitutions, '
+                                 'church = reduce with Church numerals and booleans built in')
+    arg_parser.add_argument('--strategy', choices=STRATEGIES, default='nf',
+                            help='reduce engine: how far to reduce (nf = full normal form, '
+                                 'whnf = weak head normal form, hnf = head normal form, cbv = call by value)')
+    arg_parser.add_argument('--server', action='store_true',
+                            help='answer JSON-lines requests from stdin (see server.py)')
+    arg_parser.add_argument('--socket', help='with --server, listen on this Unix socket instead')
+    arg_parser.add_argument('--max-steps', type=int, help='reduction step limit')
+    arg_parser.add_argument('--max-size', type=int, help='term size limit, in nodes')
+    arg_parser.add_argument('--timeout', type=float, help='with --server, default time limit per request in seconds')
+    arg_parser.add_argument('--stats', action='store_true', help='print evaluation statistics as JSON to stderr')
+    args = arg_parser.parse_args()
+
+    if args.server:
+        server = load_server()
+        defaults = {'max_steps': args.max_steps, 'max_size': args.max_size, 'timeout': args.timeout,
+                    'engine': args.engine, 'strategy': args.strategy}
+        if args.socket:
+            server.serve_socket(args.socket, handle_request, defaults)
+        else:
+            server.serve(sys.stdin, sys.stdout, handle_request, defaults)
+        return
+    if args.program is None:
+        arg_parser.error('a program is needed unless --server is given')
+    if args.strategy != 'nf' and args.engine != 'reduce':
+        arg_parser.error('--strategy needs --engine reduce')
 
-    input_arg = sys.argv[1]
+    input_arg = args.program
 
     if os.path.isfile(input_arg):
         with open(input_arg, 'r') as file:
@@ -147,7 +989,14 @@ def main():
     else:
         expression = input_arg
 
-    result = interpret(expression)
+    stats = Stats() if args.stats else None
+    try:
+        result = interpret(expression, args.max_steps, args.max_size, stats, args.engine, args.strategy)
+    except LimitExceeded as e:
+        sys.exit(str(e))
+    finally:
+        if stats is not None:
+            print(json.dumps(stats.as_dict()), file=sys.stderr)
     print(result)
 
 if __name__ == "__main__":
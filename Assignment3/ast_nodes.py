@@ -0,0 +1,89 @@
+"""
+ast_nodes.py
+
+Hash-consed AST nodes. mk(tag, *fields) returns the one shared Node for that
+structure, so structurally equal terms are always the same object: comparing
+two nodes is an identity check, and every node carries its hash, size and
+depth, computed once when it is created. The intern table only holds weak
+references, so nodes that are no longer used anywhere are freed as usual.
+
+Nodes of nameless terms also record `loose`, one more than the largest de
+Bruijn index that points outside the node (0 for a closed term), which lets
+shift() and substitute() skip every subterm they cannot change. `normal` is
+set by the reducer once it knows the node has no reduction step left.
+
+This is a copy of Assignment2/ast_nodes.py with these two fields in place of
+`free` and the allocation counter. It is kept here rather than shared: the
+interpreter, its backends and testing4b.py import it from this directory,
+which runs without the rest of the repository (server.py, one directory up,
+is only loaded for --server).
+"""
+import math
+import weakref
+
+
+class Node(list):
+    # a list rather than a tuple only because tuple subclasses cannot be
+    # weakly referenced; a Node is never modified after mk() creates it
+    __slots__ = ("hash", "size", "depth", "loose", "normal", "__weakref__")
+
+    __eq__ = object.__eq__
+    __ne__ = object.__ne__
+
+    def __hash__(self):
+        return self.hash
+
+    def __repr__(self):
+        return "mk" + repr(tuple(self))
+
+
+# intern key -> weak reference to the node. Child nodes are keyed by id():
+# a child cannot be freed (and its id reused) while the parent's entry is
+# still in the table, because the parent holds on to it.
+interned = {}
+
+
+def field_key(field):
+    if type(field) is Node:
+        return id(field)
+    if type(field) is str:
+        return field
+    if type(field) is float:
+        # keep 1 and 1.0 apart, and 0.0 and -0.0 as well
+        return (float, field, math.copysign(1.0, field))
+    return (type(field), field)
+
+
+def loose_indices(tag, fields):
+    if tag == "var":
+        return fields[0] + 1 if type(fields[0]) is int else 0
+    if tag == "lam":
+        return max(fields[1].loose - 1, 0)
+    if tag == "let":
+        return max(fields[1].loose, fields[2].loose - 1)
+    if tag == "letrec":
+        return max(fields[1].loose - 1, fields[2].loose - 1, 0)
+    return max([field.loose for field in fields if type(field) is Node], default=0)
+
+
+def forget(ref):
+    if interned.get(ref.key) is ref:
+        del interned[ref.key]
+
+
+def mk(tag, *fields):
+    key = (tag,) + tuple([id(field) if type(field) is Node else field_key(field) for field in fields])
+    ref = interned.get(key)
+    if ref is not None:
+        node = ref()
+        if node is not None:
+            return node
+    node = Node((tag,) + fields)
+    node.hash = hash(key)
+    children = [field for field in fields if type(field) is Node]
+    node.size = 1 + sum([child.size for child in children])
+    node.depth = 1 + max([child.depth for child in children], default=0)
+    node.loose = loose_indices(tag, fields)
+    node.normal = False
+    interned[key] = weakref.KeyedRef(node, forget, key)
+    return node
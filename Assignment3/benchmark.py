@@ -0,0 +1,236 @@
+"""
+benchmark.py
+
+Usage:
+    python benchmark.py letrec [--depths 10 100 1000] [--backends reduce machine need closure bytecode]
+    python benchmark.py stress [--depth 100000] [--backends reduce machine need closure bytecode]
+    python benchmark.py parse [--size 1000000]
+    python benchmark.py memo [--sizes 10 20 30 100 1000] [--memo-size 10000]
+    python benchmark.py strategies [--strategies weak whnf hnf nf cbv] [--repeat 3]
+
+letrec measures how the cost of a recursive program grows with its recursion
+depth, comparing recursion through a Y combinator written in the source
+program (the way letrec used to be evaluated) with the native letrec bindings.
+
+stress runs programs whose terms are nested --depth levels deep through every
+backend and checks that none of them runs out of Python stack.
+
+parse measures parsing throughput on a source of about --size bytes, building
+the AST while parsing (as interpret() does) against building a parse tree
+first and transforming it afterwards.
+
+memo times the naive fib on the closure backend with and without a Memo,
+with the memo's hit and miss counts.
+
+strategies runs programs through the reduce backend with each evaluation
+strategy and prints the reduction steps and the best evaluation time. The
+programs are optimized first, as interpret() does by default, though
+optimize() finds nothing to rewrite in them. On one machine (steps, ms):
+
+    program            weak          whnf          hnf           nf            cbv
+    fact 10             256     2.9   256     2.7   256     7.0   256     7.0    76     1.2
+    fib 10             4046   112.3  4046   119.1  4046   119.8  4046   178.5  1150    46.6
+    list 30 (result)   1926    41.5     6     0.2     6     0.2  1926    61.3   186     9.4
+    unused argument       1     0.0     1     0.0     1     0.0     1     0.0   217     9.5
+    lambda result         0     0.0     0     0.0  1956    64.5  1956    66.2     0     0.0
+"""
+import argparse
+import sys
+import time
+
+from lark import Lark, Transformer_NonRecursive
+
+import interpreter
+from closure_backend import Memo
+from interpreter import BACKENDS, STRATEGIES, Stats, interpret
+
+# a backend is not run at larger depths once a single run takes longer than this
+TIME_BUDGET = 2.0
+
+SUM_BODY = r"\n. if n == 0 then 0 else n + (sum (n + -1))"
+
+LETREC_PROGRAMS = {
+    "Y combinator": r"let fix = \f.(\x.f (x x)) (\x.f (x x)) in let sum = fix (\sum." + SUM_BODY + ") in sum {n}",
+    "letrec": "letrec sum = " + SUM_BODY + " in sum {n}",
+}
+
+
+STRESS_PROGRAMS = {
+    "list": lambda n: "tl (" + " : ".join(str(i) for i in range(n)) + " : #)",
+    "sequence": lambda n: " ;; ".join(str(i) for i in range(n)),
+    "lambdas": lambda n: "".join(f"\\x{i}." for i in range(n)) + "x0",
+    "parentheses": lambda n: "(" * n + "1" + ")" * n,
+    "applications": lambda n: r"(\x.x) (" * n + "1" + ")" * n,
+    "list equality": lambda n: "let xs = " + " : ".join("1" for _ in range(n)) + " : # in xs == xs",
+    "recursion": lambda n: "letrec sum = " + SUM_BODY + f" in sum {n}",
+}
+
+FIB = r"letrec fib = \n. if n <= 1 then n else (fib (n + -1)) + (fib (n + -2)) in fib {n}"
+
+SUM = "letrec sum = " + SUM_BODY + " in sum {n}"
+
+STRATEGY_PROGRAMS = {
+    "fact 10": r"letrec fact = \n. if n == 0 then 1 else n * (fact (n + -1)) in fact 10",
+    "fib 10": FIB.format(n=10),
+    # only whether the result is a list cell
+    "list 30 (result)": r"letrec build = \n. if n == 0 then # else n : (build (n + -1)) in build 30",
+    "unused argument": r"(\x.1) (" + SUM.format(n=30) + ")",
+    "lambda result": r"\z. " + SUM.format(n=30),
+}
+
+# programs that only finish in reasonable time with sharing
+SHARING_ONLY = {"recursion"}
+SHARING_BACKENDS = ("need", "closure", "bytecode")
+
+
+def time_program(source, backend, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        interpret(source, backend=backend)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_letrec(depths, backends):
+    print(f"{'backend':<8} {'depth':>6} " + " ".join(f"{name:>14}" for name in LETREC_PROGRAMS))
+    for backend in backends:
+        over_budget = set()
+        for depth in depths:
+            cells = []
+            for name, program in LETREC_PROGRAMS.items():
+                if name in over_budget:
+                    cells.append("skipped")
+                    continue
+                try:
+                    seconds = time_program(program.format(n=depth), backend)
+                except RecursionError:
+                    over_budget.add(name)
+                    cells.append("RecursionError")
+                    continue
+                if seconds > TIME_BUDGET:
+                    over_budget.add(name)
+                cells.append(f"{seconds * 1000:.2f} ms")
+            print(f"{backend:<8} {depth:>6} " + " ".join(f"{cell:>14}" for cell in cells))
+
+
+def bench_stress(depth, backends):
+    failures = 0
+    for name, make_program in STRESS_PROGRAMS.items():
+        source = make_program(depth)
+        for backend in backends:
+            if name in SHARING_ONLY and backend not in SHARING_BACKENDS:
+                continue
+            start = time.perf_counter()
+            try:
+                output = interpret(source, backend=backend)
+            except RecursionError:
+                failures += 1
+                output = "RecursionError"
+            elapsed = time.perf_counter() - start
+            if len(output) > 40:
+                output = output[:37] + "..."
+            print(f"{name:<14} {backend:<8} {elapsed:8.2f} s  {output}")
+    return failures
+
+
+# a program made of many small ones, joined with ;;
+PARSE_UNIT = (r"letrec fact = \n. if n == 0 then 1 else n * (fact (n - 1)) in "
+              r"let xs = 1 : 2 : 3 : # in (\x.\y. x + -y) (hd xs) (fact 5)")
+
+
+class TreeTransformer(interpreter.LambdaCalculusTransformer, Transformer_NonRecursive):
+    pass
+
+
+def bench_parse(size):
+    source = " ;; ".join([PARSE_UNIT] * (size // (len(PARSE_UNIT) + 4) + 1))
+    megabytes = len(source.encode("utf-8")) / 1e6
+
+    with open(interpreter.GRAMMAR_PATH) as f:
+        grammar = f.read()
+    tree_parser = Lark(grammar, parser="lalr", lexer="contextual", cache=True)
+    paths = {
+        "parse tree, then transform": lambda: TreeTransformer().transform(tree_parser.parse(source)),
+        "AST while parsing": lambda: interpreter.get_parser().parse(source),
+    }
+    for name, parse in paths.items():
+        best = None
+        for _ in range(3):
+            start = time.perf_counter()
+            parse()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{name:<28} {best:6.2f} s  {megabytes / best:6.2f} MB/s")
+
+
+def bench_memo(sizes, memo_size):
+    print(f"{'n':>5} {'plain':>10} {'memo':>10} {'hits':>8} {'misses':>8}")
+    last = None  # (n, seconds) of the last plain run
+    skip_plain = False
+    for n in sizes:
+        source = FIB.format(n=n)
+        # the plain run takes about 1.618 times longer for every step in n
+        skip_plain = skip_plain or (last is not None and last[1] * 1.618 ** min(n - last[0], 100) > TIME_BUDGET)
+        if skip_plain:
+            plain = "skipped"
+        else:
+            start = time.perf_counter()
+            interpret(source, backend="closure")
+            last = (n, time.perf_counter() - start)
+            plain = f"{last[1]:8.3f} s"
+        memo = Memo(memo_size)
+        start = time.perf_counter()
+        interpret(source, backend="closure", memo=memo)
+        elapsed = time.perf_counter() - start
+        print(f"{n:>5} {plain:>10} {elapsed:8.3f} s {memo.hits:>8} {memo.misses:>8}")
+
+
+def bench_strategies(strategies, repeat):
+    print(f"{'program':<18} {'strategy':<8} {'steps':>8} {'time':>11}")
+    for name, source in STRATEGY_PROGRAMS.items():
+        for strategy in strategies:
+            best = None
+            for _ in range(repeat):
+                stats = Stats()
+                interpret(source, stats=stats, strategy=strategy)
+                seconds = stats.seconds["evaluate"]
+                best = seconds if best is None else min(best, seconds)
+            print(f"{name:<18} {strategy:<8} {stats.steps:>8} {best * 1000:8.2f} ms")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmarks for the Assignment3 interpreter.")
+    sub = arg_parser.add_subparsers(dest="command", required=True)
+    letrec = sub.add_parser("letrec", help="recursion depth: Y combinator vs native letrec")
+    letrec.add_argument("--depths", type=int, nargs="+", default=[10, 30, 100, 300, 1000])
+    letrec.add_argument("--backends", choices=BACKENDS, nargs="+", default=list(BACKENDS))
+    stress = sub.add_parser("stress", help="very deeply nested terms")
+    stress.add_argument("--depth", type=int, default=100000)
+    stress.add_argument("--backends", choices=BACKENDS, nargs="+", default=list(BACKENDS))
+    parse = sub.add_parser("parse", help="parsing throughput")
+    parse.add_argument("--size", type=int, default=1000000)
+    memo = sub.add_parser("memo", help="naive fib with and without memoization")
+    memo.add_argument("--sizes", type=int, nargs="+", default=[10, 15, 20, 25, 30, 100, 1000, 3000])
+    memo.add_argument("--memo-size", type=int, default=10000)
+    strategies = sub.add_parser("strategies", help="steps and time of each evaluation strategy")
+    strategies.add_argument("--strategies", choices=STRATEGIES, nargs="+", default=list(STRATEGIES))
+    strategies.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    if args.command == "letrec":
+        bench_letrec(args.depths, args.backends)
+    elif args.command == "stress":
+        if bench_stress(args.depth, args.backends):
+            sys.exit(1)
+    elif args.command == "parse":
+        bench_parse(args.size)
+    elif args.command == "memo":
+        bench_memo(args.sizes, args.memo_size)
+    elif args.command == "strategies":
+        bench_strategies(args.strategies, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,538 @@
+"""
+bytecode.py
+
+Usage:
+    python bytecode.py compile <program> [-o program.lcb] [--no-opt] [--exact]
+    python bytecode.py run <program.lcb> [--exact]
+    python bytecode.py dis <program or program.lcb> [--no-opt]
+
+Compiles a nameless term (see interpreter.py) into a flat instruction stream
+and runs it on a stack machine, call-by-need. The code is an array('i') of
+opcodes, each followed by its operands; numbers (ints or floats) live in a
+constant pool.
+Lambda bodies and delayed arguments are compiled into blocks of their own that
+end in RETURN; MAKE_CLOSURE and MAKE_THUNK refer to a block by its address.
+
+Values are the same as in closure_backend.py, except that a Closure's body
+and a thunk's code are block addresses. When the machine cannot represent a
+result (free variables, stuck terms, lambdas in the result) it raises
+Unsupported, and interpret() falls back to the call-by-need machine and
+says so on stderr (see run_backend()).
+
+Like interpret(), compile and dis run optimize() on the program first unless
+--no-opt is given, and read whole numbers as floats unless compile is given
+--exact. A compiled program can be saved to a .lcb file and run without
+parsing the source again. The file is, in little-endian order: the magic bytes LCB3, the
+sizes of the constants (in bytes), code (in words), entry points and source
+(in bytes) and the flags (1 for --exact, 2 unless --no-opt) as 32-bit
+integers, then the constants written out as text, one per line, so that big
+ints stay exact, the code and entry points as 32-bit integers and the UTF-8
+source. The source is only parsed if the machine has to fall back, and then
+read and optimized as it was for compile, as the flags record. load() checks
+that the sizes add up to the length of the file.
+"""
+import argparse
+import struct
+import sys
+from array import array
+
+from ast_nodes import mk
+from closure_backend import NIL, NUMBERS, Closure, Cons, Unsupported, equal, readback
+
+OPCODES = [
+    # name, number of operands
+    ("PUSH_CONST", 1),    # push constant i
+    ("PUSH_NIL", 0),
+    ("LOAD", 1),          # push the value of variable k, forcing it
+    ("LOAD_CELL", 1),     # push the thunk of variable k
+    ("CONST_CELL", 1),    # push an evaluated thunk holding constant i
+    ("MAKE_THUNK", 1),    # push a thunk running block a in this environment
+    ("MAKE_CLOSURE", 1),  # push a closure with body block a
+    ("APPLY", 0),         # pop an argument thunk and a closure, call it
+    ("TAIL_APPLY", 0),    # APPLY replacing the current call
+    ("RETURN", 0),
+    ("ADD", 0),
+    ("SUB", 0),
+    ("MUL", 0),
+    ("LEQ", 0),
+    ("EQ", 0),
+    ("NEG", 0),
+    ("JUMP_IF_ZERO", 1),  # pop a number, jump to a if it is 0
+    ("JUMP", 1),
+    ("MAKE_CONS", 0),     # pop the tail and head thunks
+    ("HD", 0),
+    ("TL", 0),
+    ("BIND", 0),          # pop a thunk and bind it as variable 0
+    ("BIND_REC", 1),      # bind a thunk for block a that can see itself
+    ("UNBIND", 0),
+    ("FIX", 0),
+    ("STUCK", 0),         # a term the machine cannot evaluate
+]
+
+(PUSH_CONST, PUSH_NIL, LOAD, LOAD_CELL, CONST_CELL, MAKE_THUNK, MAKE_CLOSURE,
+ APPLY, TAIL_APPLY, RETURN, ADD, SUB, MUL, LEQ, EQ, NEG, JUMP_IF_ZERO, JUMP,
+ MAKE_CONS, HD, TL, BIND, BIND_REC, UNBIND, FIX, STUCK) = range(len(OPCODES))
+
+BINOPS = {"plus": ADD, "minus": SUB, "times": MUL, "leq": LEQ, "eq": EQ}
+
+MAGIC = b"LCB3"
+HEADER = struct.Struct("<4s5I")
+EXACT, OPT = 1, 2  # the flags in the header
+
+
+class Program:
+    def __init__(self, code, consts, entries, source=None, exact=False, opt=True):
+        self.code = code        # array("i")
+        self.consts = consts    # list of ints and floats
+        self.entries = entries  # the block of each part of a ;; b ;; c
+        self.source = source
+        # how source was turned into the program: to_ast(source, exact), then
+        # optimize() if opt
+        self.exact = exact
+        self.opt = opt
+
+
+def compile_program(tree, source=None, exact=False, opt=True):
+    code = array("i")
+    consts = []
+    const_index = {}
+    pending = []  # (position of the operand to patch, term of the block)
+
+    def constant(n):
+        key = (n, str(n))  # keeps 0.0 and -0.0 apart
+        if key not in const_index:
+            const_index[key] = len(consts)
+            consts.append(n)
+        return const_index[key]
+
+    def emit(op, operand=None):
+        code.append(op)
+        if operand is not None:
+            code.append(operand)
+
+    def block_operand(op, term):
+        emit(op, -1)
+        pending.append((len(code) - 1, term))
+
+    # the argument of an application, cons or let, as a thunk
+    def emit_arg(term):
+        if term[0] == "var":
+            emit(LOAD_CELL, term[1])
+        elif term[0] == "num":
+            emit(CONST_CELL, constant(term[1]))
+        else:
+            block_operand(MAKE_THUNK, term)
+
+    def emit_block(term):
+        # work items: ("term", term, tail), ("arg", term), ("op", op, operand),
+        # ("jump", op, label) and ("label", label), where a label is the list
+        # of operand positions still to be patched with its address
+        work = [("term", term, True)]
+        while work:
+            item = work.pop()
+            kind = item[0]
+
+            if kind == "op":
+                emit(item[1], item[2])
+                continue
+            if kind == "arg":
+                emit_arg(item[1])
+                continue
+            if kind == "jump":
+                emit(item[1], -1)
+                item[2].append(len(code) - 1)
+                continue
+            if kind == "label":
+                for position in item[1]:
+                    code[position] = len(code)
+                continue
+
+            _, term, tail = item
+            tag = term[0]
+            if tag == "num":
+                emit(PUSH_CONST, constant(term[1]))
+            elif tag == "nil":
+                emit(PUSH_NIL)
+            elif tag == "var":
+                emit(LOAD, term[1])
+            elif tag in ("free", "prog"):
+                emit(STUCK)
+            elif tag == "lam":
+                block_operand(MAKE_CLOSURE, term[2])
+            elif tag == "app":
+                work.append(("op", TAIL_APPLY if tail else APPLY, None))
+                work.append(("arg", term[2]))
+                work.append(("term", term[1], False))
+            elif tag in BINOPS:
+                work.append(("op", BINOPS[tag], None))
+                work.append(("term", term[2], False))
+                work.append(("term", term[1], False))
+            elif tag == "neg":
+                if term[1][0] == "num":
+                    emit(PUSH_CONST, constant(-term[1][1]))
+                else:
+                    work.append(("op", NEG, None))
+                    work.append(("term", term[1], False))
+            elif tag == "if":
+                else_label, end_label = [], []
+                work.append(("label", end_label))
+                work.append(("term", term[3], tail))
+                work.append(("label", else_label))
+                work.append(("jump", JUMP, end_label))
+                work.append(("term", term[2], tail))
+                work.append(("jump", JUMP_IF_ZERO, else_label))
+                work.append(("term", term[1], False))
+            elif tag == "cons":
+                work.append(("op", MAKE_CONS, None))
+                work.append(("arg", term[2]))
+                work.append(("arg", term[1]))
+            elif tag in ("hd", "tl"):
+                work.append(("op", HD if tag == "hd" else TL, None))
+                work.append(("term", term[1], False))
+            elif tag in ("let", "letrec"):
+                # in tail position RETURN restores the environment anyway
+                if not tail:
+                    work.append(("op", UNBIND, None))
+                work.append(("term", term[3], tail))
+                if tag == "let":
+                    work.append(("op", BIND, None))
+                    work.append(("arg", term[2]))
+                else:
+                    block_operand(BIND_REC, term[2])
+            elif tag == "fix":
+                work.append(("op", FIX, None))
+                work.append(("term", term[1], False))
+            else:
+                raise Exception("Unknown tree tag in compile_program:", term)
+
+        emit(RETURN)
+
+    parts = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node[0] == "prog":
+            stack.append(node[2])
+            stack.append(node[1])
+        else:
+            parts.append(node)
+
+    entries = []
+    for part in parts:
+        entries.append(len(code))
+        emit_block(part)
+    while pending:
+        position, term = pending.pop()
+        code[position] = len(code)
+        emit_block(term)
+
+    return Program(code, consts, entries, source, exact, opt)
+
+
+def lookup(env, k):
+    for _ in range(k):
+        env = env[1]
+    return env[0]
+
+
+# Run code from pc in env until the matching RETURN and give back the value
+# left on the stack. Calls and forced thunks push a frame (return address,
+# environment, thunk to update or None) instead of recursing in Python.
+def run(program, pc, env):
+    code = program.code
+    consts = program.consts
+    stack = []
+    frames = [(None, None, None)]
+
+    while True:
+        op = code[pc]
+        pc += 1
+
+        if op == LOAD:
+            cell = lookup(env, code[pc])
+            pc += 1
+            if cell[0] is None:
+                stack.append(cell[1])
+            else:
+                frames.append((pc, env, cell))
+                pc, env = cell
+
+        elif op == LOAD_CELL:
+            stack.append(lookup(env, code[pc]))
+            pc += 1
+
+        elif op == PUSH_CONST:
+            stack.append(consts[code[pc]])
+            pc += 1
+
+        elif op == CONST_CELL:
+            stack.append([None, consts[code[pc]]])
+            pc += 1
+
+        elif op == MAKE_THUNK:
+            stack.append([code[pc], env])
+            pc += 1
+
+        elif op == APPLY or op == TAIL_APPLY:
+            arg = stack.pop()
+            f = stack.pop()
+            if type(f) is not Closure:
+                raise Unsupported("application of a non-function")
+            if op == APPLY:
+                frames.append((pc, env, None))
+            pc, env = f.body, (arg, f.env)
+
+        elif op == RETURN:
+            pc, env, cell = frames.pop()
+            if cell is not None:
+                cell[0] = None
+                cell[1] = stack[-1]
+            if pc is None:
+                return stack.pop()
+
+        elif op == JUMP_IF_ZERO:
+            c = stack.pop()
+            if type(c) not in NUMBERS:
+                raise Unsupported("if on a non-number")
+            pc = code[pc] if c == 0 else pc + 1
+
+        elif op == JUMP:
+            pc = code[pc]
+
+        elif ADD <= op <= EQ:
+            b = stack.pop()
+            a = stack.pop()
+            if type(a) in NUMBERS and type(b) in NUMBERS:
+                if op == ADD:
+                    stack.append(a + b)
+                elif op == SUB:
+                    stack.append(a - b)
+                elif op == MUL:
+                    stack.append(a * b)
+                elif op == LEQ:
+                    stack.append(1 if a <= b else 0)
+                else:
+                    stack.append(1 if a == b else 0)
+            elif op == EQ:
+                stack.append(1 if equal(a, b, lambda cell: force(program, cell)) else 0)
+            else:
+                raise Unsupported("arithmetic on a non-number")
+
+        elif op == NEG:
+            n = stack.pop()
+            if type(n) not in NUMBERS:
+                raise Unsupported("negation of a non-number")
+            stack.append(-n)
+
+        elif op == MAKE_CLOSURE:
+            stack.append(Closure(code[pc], env))
+            pc += 1
+
+        elif op == MAKE_CONS:
+            tail = stack.pop()
+            stack.append(Cons(stack.pop(), tail))
+
+        elif op == HD or op == TL:
+            xs = stack.pop()
+            if type(xs) is not Cons:
+                raise Unsupported("hd or tl of a non-list")
+            cell = xs.head if op == HD else xs.tail
+            if cell[0] is None:
+                stack.append(cell[1])
+            else:
+                frames.append((pc, env, cell))
+                pc, env = cell
+
+        elif op == BIND:
+            env = (stack.pop(), env)
+
+        elif op == BIND_REC:
+            cell = [code[pc], None]
+            env = cell[1] = (cell, env)
+            pc += 1
+
+        elif op == UNBIND:
+            env = env[1]
+
+        elif op == FIX:
+            f = stack.pop()
+            if type(f) is not Closure:
+                raise Unsupported("fix of a non-function")
+            # fix f = f (fix f), with one shared thunk for fix f
+            cell = [f.body, None]
+            cell[1] = (cell, f.env)
+            frames.append((pc, env, cell))
+            pc, env = cell
+
+        elif op == PUSH_NIL:
+            stack.append(NIL)
+
+        elif op == STUCK:
+            raise Unsupported("stuck term")
+
+        else:
+            raise Exception("Unknown opcode in run:", op)
+
+
+def force(program, cell):
+    if cell[0] is not None:
+        cell[1] = run(program, cell[0], cell[1])
+        cell[0] = None
+    return cell[1]
+
+
+def run_program(program):
+    result = None
+    for entry in program.entries:
+        value = readback(run(program, entry, None), lambda cell: force(program, cell))
+        result = value if result is None else mk("prog", result, value)
+    return result
+
+
+def save(program, path):
+    code, entries = array("i", program.code), array("i", program.entries)
+    consts = "".join([repr(n) + "\n" for n in program.consts]).encode("ascii")
+    source = (program.source or "").encode("utf-8")
+    if sys.byteorder == "big":
+        for part in (code, entries):
+            part.byteswap()
+    with open(path, "wb") as f:
+        flags = (EXACT if program.exact else 0) | (OPT if program.opt else 0)
+        f.write(HEADER.pack(MAGIC, len(consts), len(code), len(entries), len(source), flags))
+        f.write(consts)
+        f.write(code.tobytes())
+        f.write(entries.tobytes())
+        f.write(source)
+
+
+# repr() writes floats with a point, an exponent, inf or nan, never as an int
+def parse_number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def load(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC:
+        raise ValueError(path + " is not a compiled program")
+    magic, n_consts, n_code, n_entries, n_source, flags = HEADER.unpack_from(data)
+    word = array("i").itemsize
+    expected = HEADER.size + n_consts + (n_code + n_entries) * word + n_source
+    if len(data) != expected:
+        raise ValueError(f"{path} is truncated or corrupt: its header gives {expected} bytes, "
+                         f"the file has {len(data)}")
+    if flags & ~(EXACT | OPT):
+        raise ValueError(f"{path} is corrupt: unknown flags {flags}")
+    offset = HEADER.size + n_consts
+    try:
+        consts = [parse_number(line) for line in data[HEADER.size:offset].decode("ascii").splitlines()]
+    except ValueError:  # UnicodeDecodeError is one too
+        raise ValueError(f"{path} is corrupt: bad constants") from None
+    parts = []
+    for count in (n_code, n_entries):
+        part = array("i")
+        size = count * part.itemsize
+        part.frombytes(data[offset:offset + size])
+        if sys.byteorder == "big":
+            part.byteswap()
+        parts.append(part)
+        offset += size
+    code, entries = parts
+    if any(not 0 <= entry < len(code) for entry in entries):
+        raise ValueError(f"{path} is corrupt: an entry point is outside the code")
+    try:
+        source = data[offset:offset + n_source].decode("utf-8") or None
+    except UnicodeDecodeError:
+        raise ValueError(f"{path} is corrupt: the source is not UTF-8") from None
+    return Program(code, consts, list(entries), source, bool(flags & EXACT), bool(flags & OPT))
+
+
+def disassemble(program):
+    code = program.code
+    starts = {}
+    for i, entry in enumerate(program.entries):
+        starts[entry] = f"part {i}"
+    pc = 0
+    while pc < len(code):
+        op = code[pc]
+        if op in (MAKE_THUNK, MAKE_CLOSURE, BIND_REC):
+            starts.setdefault(code[pc + 1], "block")
+        pc += 1 + OPCODES[op][1]
+
+    lines = [f"; {len(code)} code words ({len(code) * code.itemsize} bytes), "
+             f"{len(program.consts)} constants"]
+    pc = 0
+    while pc < len(code):
+        if pc in starts:
+            lines.append(f"{starts[pc]} @{pc}:")
+        op = code[pc]
+        name, operand_count = OPCODES[op]
+        line = f"{pc:6}  {name}"
+        if operand_count:
+            operand = code[pc + 1]
+            line = f"{line:<22}{operand}"
+            if op in (PUSH_CONST, CONST_CELL):
+                line += f"    ; {program.consts[operand]}"
+            elif op in (MAKE_THUNK, MAKE_CLOSURE, BIND_REC, JUMP, JUMP_IF_ZERO):
+                line += f"    ; -> @{operand}"
+        lines.append(line)
+        pc += 1 + operand_count
+    return "\n".join(lines)
+
+
+def main():
+    # imported here because interpreter.py imports this module
+    from interpreter import optimize, read_program, to_ast
+
+    arg_parser = argparse.ArgumentParser(description="Compile, run and disassemble Assignment3 bytecode.")
+    sub = arg_parser.add_subparsers(dest="command", required=True)
+    compile_cmd = sub.add_parser("compile", help="compile a program to a .lcb file")
+    compile_cmd.add_argument("program", help="source code or the name of a file containing it")
+    compile_cmd.add_argument("-o", "--output", default="program.lcb")
+    compile_cmd.add_argument("--no-opt", dest="opt", action="store_false", help="compile the program as written")
+    compile_cmd.add_argument("--exact", action="store_true", help="keep whole numbers as exact ints")
+    run_cmd = sub.add_parser("run", help="run a .lcb file")
+    run_cmd.add_argument("file")
+    run_cmd.add_argument("--exact", action="store_true",
+                         help="print whole numbers as ints (always done for a program compiled with --exact)")
+    dis_cmd = sub.add_parser("dis", help="print the instructions of a program or .lcb file")
+    dis_cmd.add_argument("program")
+    dis_cmd.add_argument("--no-opt", dest="opt", action="store_false", help="compile the program as written")
+    args = arg_parser.parse_args()
+
+    if args.command == "compile":
+        source = read_program(args.program)
+        ast = to_ast(source, args.exact)
+        save(compile_program(optimize(ast) if args.opt else ast, source, args.exact, args.opt), args.output)
+    elif args.command == "run":
+        from interpreter import evaluate_machine, linearize
+        try:
+            program = load(args.file)
+        except (OSError, ValueError) as e:
+            sys.exit(str(e))
+        try:
+            result = run_program(program)
+        except Unsupported as e:
+            if program.source is None:
+                raise
+            print(f"bytecode: {e}; running on the need backend instead", file=sys.stderr)
+            ast = to_ast(program.source, program.exact)
+            result = evaluate_machine(optimize(ast) if program.opt else ast, share=True)
+        print(linearize(result, args.exact or program.exact))
+    elif args.command == "dis":
+        if args.program.endswith(".lcb"):
+            try:
+                program = load(args.program)
+            except (OSError, ValueError) as e:
+                sys.exit(str(e))
+        else:
+            ast = to_ast(read_program(args.program))
+            program = compile_program(optimize(ast) if args.opt else ast)
+        print(disassemble(program))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,476 @@
+"""
+closure_backend.py
+
+Compiles a nameless term (see interpreter.py) into nested Python closures and
+runs them call-by-need. Every node becomes one closure specialized for its
+tag, taking the environment as its only argument, so running a program never
+looks at a tag again. A de Bruijn index is resolved at compile time into a
+fixed number of links to follow in the environment.
+
+Values are Python ints and floats for numbers, NIL, Cons cells whose head
+and tail are thunks, and Closures for lambdas. Anything these cannot
+represent -- free variables, a stuck term, a lambda in the result, or a
+program nested too deeply for the Python stack -- raises Unsupported, and the
+caller falls back to an engine that can build the normal form as a term.
+
+With a Memo, lambdas that always force their argument remember their result
+for each number they are applied to, which turns recursions such as the
+naive fib from exponential into linear time.
+"""
+import math
+import sys
+from collections import OrderedDict
+
+from ast_nodes import mk
+
+# Python stack frames allowed while compiling and running a program
+RECURSION_LIMIT = 20000
+
+
+class Unsupported(Exception):
+    pass
+
+
+# A thunk is a list [code, env] until it is forced and [None, value] after.
+def evaluated(value):
+    return [None, value]
+
+
+def force(thunk):
+    code = thunk[0]
+    if code is None:
+        return thunk[1]
+    value = code(thunk[1])
+    thunk[0] = None
+    thunk[1] = value
+    return value
+
+
+class Cons:
+    __slots__ = ("head", "tail")
+
+    def __init__(self, head, tail):
+        self.head = head
+        self.tail = tail
+
+
+# a lambda: body is the compiled body, run in (argument thunk, env)
+class Closure:
+    __slots__ = ("body", "env")
+
+    def __init__(self, body, env):
+        self.body = body
+        self.env = env
+
+
+NIL = object()
+
+# the types of numbers: ints for exact whole numbers, floats otherwise
+NUMBERS = (int, float)
+
+
+def lookup(env, k):
+    for _ in range(k):
+        env = env[1]
+    return env[0]
+
+
+# code returning the thunk of variable k, with the first few depths unrolled
+def compile_cell(k):
+    if k == 0:
+        return lambda env: env[0]
+    if k == 1:
+        return lambda env: env[1][0]
+    if k == 2:
+        return lambda env: env[1][1][0]
+    return lambda env: lookup(env, k)
+
+
+def compile_var(k):
+    if k == 0:
+        def var(env):
+            thunk = env[0]
+            if thunk[0] is None:
+                return thunk[1]
+            return force(thunk)
+    elif k == 1:
+        def var(env):
+            thunk = env[1][0]
+            if thunk[0] is None:
+                return thunk[1]
+            return force(thunk)
+    else:
+        def var(env):
+            thunk = lookup(env, k)
+            if thunk[0] is None:
+                return thunk[1]
+            return force(thunk)
+    return var
+
+
+# code returning a thunk for an argument: variables pass on the thunk they
+# already have, and numbers and lambdas need no delaying
+def compile_arg(tree):
+    tag = tree[0]
+    if tag == "var":
+        return compile_cell(tree[1])
+    if tag == "num":
+        thunk = evaluated(tree[1])
+        return lambda env: thunk
+    code = compile(tree)
+    if tag == "lam":
+        return lambda env: evaluated(code(env))
+    return lambda env: [code, env]
+
+
+def compile(tree):
+    tag = tree[0]
+
+    if tag == "num":
+        n = tree[1]
+        return lambda env: n
+
+    if tag == "nil":
+        return lambda env: NIL
+
+    if tag == "var":
+        return compile_var(tree[1])
+
+    if tag == "lam":
+        body = compile(tree[2])
+        if active_memo is not None and forces_var(tree[2], 0):
+            body = memoized(body, active_memo)
+        return lambda env: Closure(body, env)
+
+    if tag == "app":
+        func = compile(tree[1])
+        if tree[2][0] in ("var", "num", "lam"):
+            arg = compile_arg(tree[2])
+
+            def app(env):
+                f = func(env)
+                if type(f) is not Closure:
+                    raise Unsupported("application of a non-function")
+                return f.body((arg(env), f.env))
+            return app
+
+        # the thunk for any other argument is built right here
+        code = compile(tree[2])
+
+        def app_delayed(env):
+            f = func(env)
+            if type(f) is not Closure:
+                raise Unsupported("application of a non-function")
+            return f.body(([code, env], f.env))
+        return app_delayed
+
+    if tag in ("plus", "minus", "times", "leq", "eq"):
+        return compile_binop(tag, tree[1], tree[2])
+
+    if tag == "neg":
+        if tree[1][0] == "num":
+            n = -tree[1][1]
+            return lambda env: n
+        expr = compile(tree[1])
+
+        def neg(env):
+            n = expr(env)
+            if type(n) not in NUMBERS:
+                raise Unsupported("negation of a non-number")
+            return -n
+        return neg
+
+    if tag == "if":
+        cond, thn, els = compile(tree[1]), compile(tree[2]), compile(tree[3])
+
+        def if_(env):
+            c = cond(env)
+            if type(c) not in NUMBERS:
+                raise Unsupported("if on a non-number")
+            return thn(env) if c != 0 else els(env)
+        return if_
+
+    if tag == "cons":
+        head, tail = compile_arg(tree[1]), compile_arg(tree[2])
+        return lambda env: Cons(head(env), tail(env))
+
+    if tag in ("hd", "tl"):
+        xs = compile(tree[1])
+        pick_head = tag == "hd"
+
+        def hd_tl(env):
+            cell = xs(env)
+            if type(cell) is not Cons:
+                raise Unsupported(tag + " of a non-list")
+            thunk = cell.head if pick_head else cell.tail
+            if thunk[0] is None:
+                return thunk[1]
+            return force(thunk)
+        return hd_tl
+
+    if tag == "let":
+        value, body = compile_arg(tree[2]), compile(tree[3])
+        return lambda env: body((value(env), env))
+
+    if tag == "letrec":
+        value, body = compile(tree[2]), compile(tree[3])
+
+        def letrec(env):
+            thunk = [value, None]
+            thunk[1] = inner = (thunk, env)
+            return body(inner)
+        return letrec
+
+    if tag == "fix":
+        func = compile(tree[1])
+
+        def fix(env):
+            f = func(env)
+            if type(f) is not Closure:
+                raise Unsupported("fix of a non-function")
+            # fix f = f (fix f), sharing one thunk for fix f
+            thunk = [f.body, None]
+            thunk[1] = (thunk, f.env)
+            return force(thunk)
+        return fix
+
+    if tag == "free":
+        raise Unsupported("free variable " + tree[1])
+
+    if tag == "prog":
+        raise Unsupported("sequence inside a term")
+
+    raise Exception("Unknown tree tag in compile:", tree)
+
+
+OPERATORS = {
+    "plus": lambda a, b: a + b,
+    "minus": lambda a, b: a - b,
+    "times": lambda a, b: a * b,
+    "leq": lambda a, b: 1 if a <= b else 0,
+    "eq": lambda a, b: 1 if a == b else 0,
+}
+
+
+# The operator is inlined for the common operators; a number on the right,
+# as in n + -1 or n == 0, is inlined as a constant.
+def compile_binop(tag, left_tree, right_tree):
+    left = compile(left_tree)
+    apply = OPERATORS[tag]
+
+    if right_tree[0] == "num" or (right_tree[0] == "neg" and right_tree[1][0] == "num"):
+        c = compile(right_tree)(None)
+        if tag == "plus":
+            def op(env):
+                a = left(env)
+                if type(a) in NUMBERS:
+                    return a + c
+                return mismatch(tag, a, c)
+        elif tag == "eq":
+            def op(env):
+                a = left(env)
+                if type(a) in NUMBERS:
+                    return 1 if a == c else 0
+                return mismatch(tag, a, c)
+        else:
+            def op(env):
+                a = left(env)
+                if type(a) in NUMBERS:
+                    return apply(a, c)
+                return mismatch(tag, a, c)
+        return op
+
+    right = compile(right_tree)
+    if tag == "plus":
+        def op(env):
+            a = left(env)
+            b = right(env)
+            if type(a) in NUMBERS and type(b) in NUMBERS:
+                return a + b
+            return mismatch(tag, a, b)
+    elif tag == "times":
+        def op(env):
+            a = left(env)
+            b = right(env)
+            if type(a) in NUMBERS and type(b) in NUMBERS:
+                return a * b
+            return mismatch(tag, a, b)
+    else:
+        def op(env):
+            a = left(env)
+            b = right(env)
+            if type(a) in NUMBERS and type(b) in NUMBERS:
+                return apply(a, b)
+            return mismatch(tag, a, b)
+    return op
+
+
+# an operator applied to something other than two numbers: == can still
+# compare lists, anything else is stuck
+def mismatch(tag, a, b):
+    if tag == "eq":
+        return 1 if equal(a, b) else 0
+    raise Unsupported("arithmetic on a non-number")
+
+
+# == compares numbers and whole lists; both sides are forced completely, as
+# the other backends read them back before comparing. force evaluates a
+# thunk; the bytecode VM passes its own.
+def equal(a, b, force=force):
+    a, b = data(a, force), data(b, force)
+    pairs = [(a, b)]
+    while pairs:
+        x, y = pairs.pop()
+        if type(x) in NUMBERS and type(y) in NUMBERS:
+            if x != y:
+                return False
+        elif type(x) is tuple and type(y) is tuple:
+            pairs.append((x[1], y[1]))
+            pairs.append((x[0], y[0]))
+        elif not (x is NIL and y is NIL):
+            return False
+    return True
+
+
+# a value with its lists forced all the way down, as nested (head, tail) tuples
+def data(value, force=force):
+    results = []
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if item is None:
+            tail = results.pop()
+            results.append((results.pop(), tail))
+            continue
+        if type(item) is list:
+            item = force(item)
+        if type(item) is Cons:
+            stack.append(None)
+            stack.append(item.tail)
+            stack.append(item.head)
+        elif type(item) in NUMBERS or item is NIL:
+            results.append(item)
+        else:
+            raise Unsupported("function where a number or list is expected")
+    return results[0]
+
+
+def readback(value, force=force):
+    results = []
+    stack = [data(value, force)]
+    while stack:
+        item = stack.pop()
+        if item is None:
+            tail = results.pop()
+            results.append(mk("cons", results.pop(), tail))
+        elif type(item) is tuple:
+            stack.append(None)
+            stack.append(item[1])
+            stack.append(item[0])
+        elif item is NIL:
+            results.append(mk("nil"))
+        else:
+            results.append(mk("num", item))
+    return results[0]
+
+
+# Results of lambda bodies by (body, environment, argument), for arguments
+# that are numbers, keeping the size most recently used. The lambda must
+# force its argument anyway, so looking at it first changes nothing; as
+# programs have no side effects, the same body in the same environment
+# applied to the same number always gives the same value.
+class Memo:
+    def __init__(self, size=10000):
+        self.size = size
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def as_dict(self):
+        return {"size": self.size, "entries": len(self.results), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+
+# the Memo lam nodes are compiled with, set by evaluate_closure()
+active_memo = None
+
+
+# whether evaluating tree certainly forces variable k first thing: it is in
+# a position that is always evaluated, such as an operand or a condition
+def forces_var(tree, k):
+    stack = [(tree, k)]
+    while stack:
+        tree, k = stack.pop()
+        tag = tree[0]
+        if tag == "var":
+            if tree[1] == k:
+                return True
+        elif tag in ("plus", "minus", "times", "leq", "eq"):
+            stack.append((tree[2], k))
+            stack.append((tree[1], k))
+        elif tag in ("neg", "if", "hd", "tl", "app", "fix"):
+            stack.append((tree[1], k))
+        elif tag in ("let", "letrec"):
+            stack.append((tree[3], k + 1))
+    return False
+
+
+def memoized(body, memo):
+    results = memo.results
+
+    def memo_body(env):
+        thunk = env[0]
+        n = thunk[1] if thunk[0] is None else force(thunk)
+        # the environment is kept alive by its entry, so its id stays unique
+        if type(n) is int:
+            key = (body, id(env[1]), n)
+        elif type(n) is float:
+            key = (body, id(env[1]), n, math.copysign(1.0, n))
+        else:
+            return body(env)
+        entry = results.get(key)
+        if entry is not None:
+            results.move_to_end(key)
+            memo.hits += 1
+            return entry[1]
+        memo.misses += 1
+        value = body(env)
+        results[key] = (env[1], value)
+        if len(results) > memo.size:
+            results.popitem(last=False)
+            memo.evictions += 1
+        return value
+    return memo_body
+
+
+def evaluate_closure(tree, memo=None):
+    global active_memo
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, RECURSION_LIMIT))
+    active_memo = memo
+    try:
+        return run_program(tree)
+    except RecursionError:
+        raise Unsupported("too deeply nested") from None
+    finally:
+        active_memo = None
+        sys.setrecursionlimit(limit)
+
+
+# the parts of a top-level a ;; b ;; c are run one after the other
+def run_program(tree):
+    results = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node is None:
+            right = results.pop()
+            results.append(mk("prog", results.pop(), right))
+        elif node[0] == "prog":
+            stack.append(None)
+            stack.append(node[2])
+            stack.append(node[1])
+        else:
+            results.append(readback(compile(node)(None)))
+    return results[0]
@@ -1,135 +1,120 @@
 from lark import Lark, Transformer
+import argparse
+import importlib.util
+import json
 import os
 import sys
+import time
 
-parser = Lark(open("grammar.lark").read(), parser="lalr", lexer="contextual")
+from ast_nodes import Node, mk
+from bytecode import compile_program, run_program
+from closure_backend import Memo, Unsupported, evaluate_closure
 
+GRAMMAR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "grammar.lark")
+# server.py is shared by both interpreters and lives one directory up
+SERVER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server.py")
+parser = None
 
-class LambdaCalculusTransformer(Transformer):
-    def start(self, args):
-        return args[0]
-
-    def seq_expr(self, args):
-        if len(args) == 1:
-            return args[0]
-        return args[0]  # Grammar handles this
-
-    def lam_expr(self, args):
-        return args[0]
-
-    def if_expr(self, args):
-        return args[0]
-
-    def letrec_expr(self, args):
-        return args[0]
-
-    def let_expr(self, args):
-        return args[0]
-
-    def fix_expr(self, args):
-        return args[0]
-
-    def eq_expr(self, args):
-        return args[0]
-
-    def leq_expr(self, args):
-        return args[0]
-
-    def cons_expr(self, args):
-        return args[0]
-
-    def hd_tl_expr(self, args):
-        return args[0]
-
-    def add_expr(self, args):
-        return args[0]
 
-    def mul_expr(self, args):
-        return args[0]
+# the parser is built on first use; Lark caches its tables in the temp
+# directory, keyed by the grammar, so later runs just load them. The
+# transformer runs inside the parser, which builds the AST directly instead
+# of a parse tree that would be transformed afterwards.
+def get_parser():
+    global parser
+    if parser is None:
+        with open(GRAMMAR_PATH) as f:
+            parser = Lark(f.read(), parser="lalr", lexer="contextual", cache=True,
+                          transformer=LambdaCalculusTransformer())
+    return parser
 
-    def app_expr(self, args):
-        return args[0]
-
-    def neg_atom(self, args):
-        return args[0]
-
-    def atom(self, args):
-        return args[0]
 
+class LambdaCalculusTransformer(Transformer):
     def lam(self, args):
         name, body = args
-        return ("lam", str(name), body)
+        return mk("lam", str(name), body)
 
     def app(self, args):
         func, arg = args
-        return ("app", func, arg)
+        return mk("app", func, arg)
 
     def var(self, args):
         (token,) = args
-        return ("var", str(token))
+        return mk("var", str(token))
 
+    # a number without a fractional part is an exact int; arithmetic on
+    # ints stays exact, and mixing in a float gives a float. to_debruijn()
+    # turns the ints into floats again unless exact=True.
     def num(self, args):
         (token,) = args
-        return ("num", float(token))
+        return mk("num", float(token) if "." in token else int(token))
 
     def plus(self, args):
         left, right = args
-        return ("plus", left, right)
+        return mk("plus", left, right)
 
     def minus(self, args):
         left, right = args
-        return ("minus", left, right)
+        return mk("minus", left, right)
 
     def times(self, args):
         left, right = args
-        return ("times", left, right)
+        return mk("times", left, right)
 
     def neg(self, args):
         (expr,) = args
-        return ("neg", expr)
+        return mk("neg", expr)
 
     def ifexp(self, args):
         c, t, e = args
-        return ("if", c, t, e)
+        return mk("if", c, t, e)
 
     def letexp(self, args):
         name, value, body = args
-        return ("let", str(name), value, body)
+        return mk("let", str(name), value, body)
 
     def letrecexp(self, args):
         name, value, body = args
-        return ("letrec", str(name), value, body)
+        return mk("letrec", str(name), value, body)
 
     def eq(self, args):
         a, b = args
-        return ("eq", a, b)
+        return mk("eq", a, b)
 
     def leq(self, args):
         a, b = args
-        return ("leq", a, b)
+        return mk("leq", a, b)
 
     def nil(self, _args):
-        return ("nil",)
+        return mk("nil")
 
     def cons(self, args):
         h, t = args
-        return ("cons", h, t)
+        return mk("cons", h, t)
+
+    # [a, b, c] is a : b : c : #, built from the flat list of items, so
+    # the parser never nests a long list
+    def list(self, items):
+        xs = mk("nil")
+        for item in reversed(items):
+            xs = mk("cons", item, xs)
+        return xs
 
     def hd(self, args):
         (xs,) = args
-        return ("hd", xs)
+        return mk("hd", xs)
 
     def tl(self, args):
         (xs,) = args
-        return ("tl", xs)
+        return mk("tl", xs)
 
     def prog(self, args):
         left, right = args
-        return ("prog", left, right)
+        return mk("prog", left, right)
 
     def fix(self, args):
         (expr,) = args
-        return ("fix", expr)
+        return mk("fix", expr)
 
     def NAME(self, token):
         return str(token)
@@ -138,185 +123,996 @@ class LambdaCalculusTransformer(Transformer):
         return str(token)
 
 
-def evaluate(tree):
+# Internally terms are nameless: a bound variable is ("var", k) where k is the
+# number of binders between the variable and the one that binds it, and a free
+# variable is ("free", name). lam, let and letrec keep the source name only as
+# a hint for linearize(). The body of a lam/let and both sides of a letrec are
+# under the binder.
+#
+# Terms are hash-consed (see ast_nodes.py): they are built with mk(), so equal
+# terms are the same object and a step that changes nothing can be detected
+# with `is`.
+#
+# None of the traversals below recurse in Python; they keep an explicit stack,
+# so a term can be as deep as memory allows rather than sys.getrecursionlimit().
+
+# the positions of the subterms of every node, each with the number of
+# binders (0 or 1) that node puts around it
+CHILDREN = {
+    "var": (), "free": (), "num": (), "nil": (),
+    "lam": ((2, 1),),
+    "let": ((2, 0), (3, 1)),
+    "letrec": ((2, 1), (3, 1)),
+    "neg": ((1, 0),), "hd": ((1, 0),), "tl": ((1, 0),), "fix": ((1, 0),),
+    "if": ((1, 0), (2, 0), (3, 0)),
+}
+for _tag in ("app", "plus", "minus", "times", "eq", "leq", "cons", "prog"):
+    CHILDREN[_tag] = ((1, 0), (2, 0))
+
+
+# Rebuild tree bottom-up. leaf(node, ctx) returns the new version of a node
+# without subterms, or a [node, ctx] list to rebuild in its place instead.
+# enter(node, ctx) returns the new (tag, name) head of a binder and the ctx
+# for the subterms under it; leave(head) is called when the binder is done.
+# Subterms for which keep(node, ctx) is true are reused as they are.
+def rebuild(tree, ctx, leaf, enter, leave=None, keep=None):
+    results = []
+    stack = [(tree, ctx)]
+    while stack:
+        node, ctx = stack.pop()
+
+        if keep is not None and node is not None and keep(node, ctx):
+            results.append(node)
+            continue
+
+        if node is None:
+            head, count, binder = ctx
+            start = len(results) - count
+            children = results[start:]
+            del results[start:]
+            results.append(mk(*head, *children))
+            if binder and leave is not None:
+                leave(head)
+            continue
+
+        positions = CHILDREN[node[0]]
+        if not positions:
+            new = leaf(node, ctx)
+            if type(new) is list:
+                stack.append((new[0], new[1]))
+            else:
+                results.append(new)
+            continue
+
+        if node[0] in ("lam", "let", "letrec"):
+            head, inner = enter(node, ctx)
+            stack.append((None, (head, len(positions), True)))
+        else:
+            inner = ctx
+            stack.append((None, ((node[0],), len(positions), False)))
+        for position, under_binder in reversed(positions):
+            stack.append((node[position], inner if under_binder else ctx))
+
+    return results[0]
+
+
+def enter_binder(node, depth):
+    return node[:2], depth + 1
+
+
+# exact=False makes every number a float, so that arithmetic works as it
+# always has, rounding and keeping the sign of zero (-0 is -0.0)
+def to_debruijn(tree, exact=False):
+    # the scope is a linked list (name, rest) with the innermost binder first
+    def leaf(node, scope):
+        if node[0] == "num" and not exact and type(node[1]) is int:
+            return mk("num", float(node[1]))
+        if node[0] != "var":
+            return node
+        name, k = node[1], 0
+        while scope is not None:
+            if scope[0] == name:
+                return mk("var", k)
+            scope, k = scope[1], k + 1
+        return mk("free", name)
+
+    def enter(node, scope):
+        return node[:2], (node[1], scope)
+
+    return rebuild(tree, None, leaf, enter)
+
+
+# raised by evaluate() when a limit is hit, term being how far it got, and by
+# the machine when it runs out of steps, term being what it was evaluating
+class LimitExceeded(Exception):
+    def __init__(self, message, term, steps):
+        super().__init__(message)
+        self.term = term
+        self.steps = steps
+        self.size = term.size
+
+
+class StepLimitExceeded(LimitExceeded):
+    pass
+
+
+class SizeLimitExceeded(LimitExceeded):
+    pass
+
+
+# max_steps is the most reduction steps to take, max_size the most nodes the
+# term may grow to; stats, if given, records every step (see Stats). strategy
+# is one of STRATEGIES; all but "weak" are run by StrategyReducer below.
+def evaluate(tree, max_steps=None, max_size=None, stats=None, strategy="weak"):
+    if strategy != "weak":
+        return StrategyReducer(strategy, max_steps, max_size, stats).run(tree)
+    # The leftmost step is taken first: the search goes down through the
+    # subterms in REDUCE_ORDER and contracts the first node whose subterms are
+    # normal and that has a step to take. After a step it carries on from the
+    # subterm that changed instead of going back to the root: everything to
+    # its left is already normal, and its ancestors are still waiting for it.
+    # So each ancestor is rebuilt once, when the search leaves it, and not
+    # after every step below it. A subterm found to have no step left is
+    # marked `normal`; as nodes are shared, this holds wherever it occurs, so
+    # an evaluated list or number is passed over at once when it comes back.
+    steps = 0
+    size = tree.size
+    if stats is not None:
+        stats.record(tree)
+    path = []
+    # with stats, how deep the term goes beside the path, for each entry of it
+    beside = [] if stats is not None else None
+    node = tree
     while True:
-        new_tree = reduce_once(tree)
-        if new_tree == tree:
-            return tree
-        tree = new_tree
-
-
-def reduce_once(tree):
+        order = REDUCE_ORDER.get(node[0])
+        if order and not node.normal:
+            if beside is not None:
+                beside.append(depth_beside(node, order[0], len(path), beside[-1] if beside else 0))
+            path.append((node, 0))
+            node = node[order[0]]
+            continue
+
+        new = node if node.normal else contract(node, stats)
+        while new is node:
+            node.normal = True
+            if not path:
+                return node
+            parent, i = path.pop()
+            if beside is not None:
+                beside.pop()
+            order = REDUCE_ORDER[parent[0]]
+            if parent[order[i]] is not node:
+                fields = parent[:]
+                fields[order[i]] = node
+                parent = mk(*fields)
+            if i + 1 < len(order):
+                if beside is not None:
+                    beside.append(depth_beside(parent, order[i + 1], len(path), beside[-1] if beside else 0))
+                path.append((parent, i + 1))
+                node = parent[order[i + 1]]
+                break
+            node = parent
+            new = contract(parent, stats)
+        else:
+            if max_steps is not None and steps == max_steps:
+                raise StepLimitExceeded(f"no normal form after {steps} steps", plug(path, node), steps)
+            steps += 1
+            size += new.size - node.size
+            if stats is not None:
+                stats.contracted(node)
+            node = new
+            if stats is not None:
+                stats.steps += 1
+                stats.record_measures(size, max(beside[-1] if beside else 0, len(path) + node.depth))
+            if max_size is not None and size > max_size:
+                raise SizeLimitExceeded(f"term grew to {size} nodes after {steps} steps", plug(path, node), steps)
+
+
+# the depth the term reaches beside the subterm at position in parent, given
+# the level of parent in the term and the depth reached above it
+def depth_beside(parent, position, level, above):
+    for j in range(1, len(parent)):
+        if j != position and type(parent[j]) is Node and level + 1 + parent[j].depth > above:
+            above = level + 1 + parent[j].depth
+    return above
+
+
+# the whole term, with node put in the place the path of evaluate() leads to
+def plug(path, node):
+    for parent, i in reversed(path):
+        fields = parent[:]
+        fields[REDUCE_ORDER[parent[0]][i]] = node
+        node = mk(*fields)
+    return node
+
+
+# the subterms evaluate() reduces, in order, before the node itself
+REDUCE_ORDER = {
+    "cons": (1, 2), "prog": (1, 2), "app": (1,),
+    "plus": (1, 2), "minus": (1, 2), "times": (1, 2),
+    "neg": (1,), "if": (1,), "hd": (1,), "tl": (1,),
+    "eq": (1, 2), "leq": (1, 2),
+}
+
+
+# the reduction rule for the node itself, once its subterms are in normal
+# form; stats, if given, counts the calls to substitute()
+def contract(tree, stats=None):
     tag = tree[0]
 
-    if tag in ("var", "num", "nil"):
-        return tree
-
-    if tag == "lam":
-        return tree
-
-    if tag == "cons":
-        h, t = tree[1], tree[2]
-        new_h = reduce_once(h)
-        if new_h != h:
-            return ("cons", new_h, t)
-        new_t = reduce_once(t)
-        if new_t != t:
-            return ("cons", h, new_t)
-        return tree
-
-    if tag == "prog":
-        # Evaluate left side first
-        left, right = tree[1], tree[2]
-        new_left = reduce_once(left)
-        if new_left != left:
-            return ("prog", new_left, right)
-        # Once left is fully evaluated, evaluate right
-        new_right = reduce_once(right)
-        if new_right != right:
-            return ("prog", left, new_right)
+    if tag in ("var", "free", "num", "nil", "lam", "cons", "prog"):
         return tree
 
     if tag == "app":
         func, arg = tree[1], tree[2]
-        reduced_func = reduce_once(func)
-        if reduced_func != func:
-            return ("app", reduced_func, arg)
         if func[0] == "lam":
-            _, name, body = func
-            return substitute(body, name, arg)
+            if stats is not None:
+                stats.substitute += 1
+            return substitute(func[2], arg)
         return tree
 
     if tag in ("plus", "minus", "times"):
         left, right = tree[1], tree[2]
-        new_left = reduce_once(left)
-        if new_left != left:
-            return (tag, new_left, right)
-        new_right = reduce_once(right)
-        if new_right != right:
-            return (tag, left, new_right)
         if left[0] == "num" and right[0] == "num":
             if tag == "plus":
-                return ("num", left[1] + right[1])
+                return mk("num", left[1] + right[1])
             if tag == "minus":
-                return ("num", left[1] - right[1])
+                return mk("num", left[1] - right[1])
             if tag == "times":
-                return ("num", left[1] * right[1])
+                return mk("num", left[1] * right[1])
         return tree
 
     if tag == "neg":
         expr = tree[1]
-        new_expr = reduce_once(expr)
-        if new_expr != expr:
-            return ("neg", new_expr)
         if expr[0] == "num":
-            return ("num", -expr[1])
+            return mk("num", -expr[1])
         return tree
 
     if tag == "if":
         cond, thn, els = tree[1], tree[2], tree[3]
-        new_cond = reduce_once(cond)
-        if new_cond != cond:
-            return ("if", new_cond, thn, els)
         if cond[0] == "num":
             return thn if cond[1] != 0 else els
         return tree
 
     if tag == "let":
         name, value, body = tree[1], tree[2], tree[3]
-        return ("app", ("lam", name, body), value)
+        return mk("app", mk("lam", name, body), value)
 
     if tag == "letrec":
+        # letrec f = v in b --> (\f.b) (fix (\f.v))
         name, value, body = tree[1], tree[2], tree[3]
-        Y = (
-            "lam",
-            "f",
-            (
-                "app",
-                ("lam", "x", ("app", ("var", "f"), ("app", ("var", "x"), ("var", "x")))),
-                ("lam", "x", ("app", ("var", "f"), ("app", ("var", "x"), ("var", "x")))),
-            ),
-        )
-        fix_value = ("app", Y, ("lam", name, value))
-        return ("app", ("lam", name, body), fix_value)
+        return mk("app", mk("lam", name, body), mk("fix", mk("lam", name, value)))
 
     if tag == "fix":
-        # fix F --> F (fix F)
+        # fix F --> F (fix F), without building the application for a lambda
         f = tree[1]
-        return ("app", f, tree)
-
-    if tag == "hd":
-        xs = tree[1]
-        new_xs = reduce_once(xs)
-        if new_xs != xs:
-            return ("hd", new_xs)
-        if xs[0] == "cons":
-            return xs[1]
-        return tree
+        if f[0] == "lam":
+            if stats is not None:
+                stats.substitute += 1
+            return substitute(f[2], tree)
+        return mk("app", f, tree)
 
-    if tag == "tl":
+    if tag in ("hd", "tl"):
         xs = tree[1]
-        new_xs = reduce_once(xs)
-        if new_xs != xs:
-            return ("tl", new_xs)
         if xs[0] == "cons":
-            return xs[2]
+            return xs[1] if tag == "hd" else xs[2]
         return tree
 
     if tag == "eq":
         a, b = tree[1], tree[2]
-        new_a = reduce_once(a)
-        if new_a != a:
-            return ("eq", new_a, b)
-        new_b = reduce_once(b)
-        if new_b != b:
-            return ("eq", a, new_b)
-
-        def force(x):
-            if x[0] != "cons":
-                return x
-            h, t = x[1], x[2]
-            nh = reduce_once(h)
-            if nh != h:
-                return ("cons", nh, t)
-            nt = reduce_once(t)
-            if nt != t:
-                return ("cons", h, nt)
-            return x
-
-        fa = force(a)
-        if fa != a:
-            return ("eq", fa, b)
-        fb = force(b)
-        if fb != b:
-            return ("eq", a, fb)
-
-        def eqv(x, y):
-            if x[0] == "num" and y[0] == "num":
-                return x[1] == y[1]
-            if x[0] == "nil" and y[0] == "nil":
-                return True
-            if x[0] == "cons" and y[0] == "cons":
-                return eqv(x[1], y[1]) and eqv(x[2], y[2])
-            return False
-
         if a[0] in ("num", "nil", "cons") and b[0] in ("num", "nil", "cons"):
-            return ("num", 1.0 if eqv(a, b) else 0.0)
+            return mk("num", 1 if eqv(a, b) else 0)
         return tree
 
     if tag == "leq":
         a, b = tree[1], tree[2]
-        new_a = reduce_once(a)
-        if new_a != a:
-            return ("leq", new_a, b)
-        new_b = reduce_once(b)
-        if new_b != b:
-            return ("leq", a, new_b)
         if a[0] == "num" and b[0] == "num":
-            return ("num", 1.0 if a[1] <= b[1] else 0.0)
+            return mk("num", 1 if a[1] <= b[1] else 0)
         return tree
 
-    raise Exception("Unknown tree tag in reduce_once:", tree)
+    raise Exception("Unknown tree tag in contract:", tree)
+
+
+# How far evaluate() reduces:
+#   weak  everything but lambda bodies and the arguments of stuck applications,
+#         in the order of REDUCE_ORDER (the default)
+#   whnf  weak head normal form: only until the outermost node is a lambda, a
+#         number, a list cell or stuck; the fields of a list cell are left as
+#         they are
+#   hnf   head normal form: whnf, then the same again under every lambda at the
+#         top
+#   nf    full normal form: hnf, then every subterm, under lambdas too
+#   cbv   call by value: as whnf, but the argument of an application, the value
+#         of a let and both fields of a list cell are reduced before they are
+#         used
+STRATEGIES = ("weak", "whnf", "hnf", "nf", "cbv")
+
+# the subterms that have to be values before a node can be contracted
+WHNF_ORDER = {
+    "app": (1,), "plus": (1, 2), "minus": (1, 2), "times": (1, 2),
+    "neg": (1,), "if": (1,), "hd": (1,), "tl": (1,), "eq": (1, 2), "leq": (1, 2),
+}
+CBV_ORDER = dict(WHNF_ORDER, app=(1, 2), let=(2,), cons=(1, 2))
+
+
+# Reduces a term with one of the strategies other than "weak". Like
+# evaluate(), value() keeps the path to the subterm it is working on and goes
+# on from there after each step. max_size applies to the subterm being
+# reduced, and stats records that subterm.
+class StrategyReducer:
+    def __init__(self, strategy, max_steps=None, max_size=None, stats=None):
+        if strategy not in STRATEGIES or strategy == "weak":
+            raise ValueError("Unknown strategy: " + strategy)
+        self.strategy = strategy
+        self.order = CBV_ORDER if strategy == "cbv" else WHNF_ORDER
+        self.max_steps = max_steps
+        self.max_size = max_size
+        self.stats = stats
+        self.steps = 0
+
+    # the parts of a program a ;; b are reduced one by one
+    def run(self, tree):
+        if self.stats is not None:
+            self.stats.record(tree)
+        reduce = self.head if self.strategy == "hnf" else self.normal if self.strategy == "nf" else self.value
+        parts = []
+        while tree[0] == "prog":
+            parts.append(tree[2])
+            tree = tree[1]
+        result = reduce(tree)
+        for part in reversed(parts):
+            result = mk("prog", result, reduce(part))
+        return result
+
+    def step(self, tree, new):
+        if self.max_steps is not None and self.steps == self.max_steps:
+            raise StepLimitExceeded(f"no {self.strategy} result after {self.steps} steps", tree, self.steps)
+        self.steps += 1
+        if self.stats is not None:
+            self.stats.contracted(tree)
+            self.stats.steps += 1
+            self.stats.record(new)
+        if self.max_size is not None and new.size > self.max_size:
+            raise SizeLimitExceeded(f"term grew to {new.size} nodes after {self.steps} steps", new, self.steps)
+
+    # contract(), except that two list cells are compared one field at a
+    # time, as the fields need not be reduced yet. Cells that already hold
+    # numbers are compared in the same step, so two evaluated lists take
+    # one step rather than one per element.
+    def contract(self, tree):
+        if tree[0] == "eq" and tree[1][0] == "cons" and tree[2][0] == "cons":
+            a, b = tree[1], tree[2]
+            while a[0] == "cons" and b[0] == "cons" and a[1][0] == "num" and b[1][0] == "num":
+                if a[1][1] != b[1][1]:
+                    return mk("num", 0)
+                a, b = a[2], b[2]
+            if a is b:
+                return mk("num", 1)
+            if a[0] == "cons" and b[0] == "cons":
+                return mk("if", mk("eq", a[1], b[1]), mk("eq", a[2], b[2]), mk("num", 0))
+            return contract(mk("eq", a, b), self.stats)
+        return contract(tree, self.stats)
+
+    # whnf, or for cbv a value. path holds (node, i) for every node waiting
+    # for the subterm at its i-th position in self.order to become a value.
+    def value(self, tree):
+        order = self.order
+        path = []
+        node = tree
+        while True:
+            positions = order.get(node[0])
+            if positions:
+                path.append((node, 0))
+                node = node[positions[0]]
+                continue
+
+            new = self.contract(node)
+            while new is node:
+                if not path:
+                    return node
+                parent, i = path.pop()
+                positions = order[parent[0]]
+                if parent[positions[i]] is not node:
+                    fields = parent[:]
+                    fields[positions[i]] = node
+                    parent = mk(*fields)
+                if i + 1 < len(positions):
+                    path.append((parent, i + 1))
+                    node = parent[positions[i + 1]]
+                    break
+                node = parent
+                new = self.contract(node)
+            else:
+                self.step(node, new)
+                node = new
+
+    def head(self, tree):
+        names = []
+        tree = self.value(tree)
+        while tree[0] == "lam":
+            names.append(tree[1])
+            tree = self.value(tree[2])
+        for name in reversed(names):
+            tree = mk("lam", name, tree)
+        return tree
+
+    # every subterm of the whnf is brought to normal form in turn, leftmost
+    # first; a (head, count) tuple on the stack rebuilds a node from the last
+    # count results
+    def normal(self, tree):
+        results = []
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if type(node) is tuple:
+                head, count = node
+                start = len(results) - count
+                children = results[start:]
+                del results[start:]
+                results.append(mk(*head, *children))
+                continue
+            node = self.value(node)
+            positions = CHILDREN[node[0]]
+            if not positions:
+                results.append(node)
+                continue
+            stack.append((tuple(node[:positions[0][0]]), len(positions)))
+            for position, _ in reversed(positions):
+                stack.append(node[position])
+        return results[0]
+
+
+def eqv(x, y):
+    pairs = [(x, y)]
+    while pairs:
+        x, y = pairs.pop()
+        if x is y:
+            continue
+        if x[0] == "num" and y[0] == "num":
+            if x[1] != y[1]:
+                return False
+        elif x[0] == "cons" and y[0] == "cons":
+            pairs.append((x[2], y[2]))
+            pairs.append((x[1], y[1]))
+        elif not (x[0] == "nil" and y[0] == "nil"):
+            return False
+    return True
+
+
+# add amount to every variable that points past the innermost cutoff binders
+def shift(tree, amount, cutoff=0):
+    if amount == 0:
+        return tree
+
+    def leaf(node, cutoff):
+        if node[0] == "var" and node[1] >= cutoff:
+            return mk("var", node[1] + amount)
+        return node
+
+    return rebuild(tree, cutoff, leaf, enter_binder, keep=lambda node, cutoff: node.loose <= cutoff)
+
+
+# for beta reduction: replace the variable bound by the removed binder (index
+# depth inside tree) with replacement; variables bound further out move one
+# binder closer. No renaming is ever needed.
+def substitute(tree, replacement, depth=0):
+    def leaf(node, depth):
+        if node[0] == "var":
+            k = node[1]
+            if k == depth:
+                return shift(replacement, depth)
+            if k > depth:
+                return mk("var", k - 1)
+        return node
+
+    return rebuild(tree, depth, leaf, enter_binder, keep=lambda node, depth: node.loose <= depth)
+
+
+# Static optimization (interpret(..., opt=True), the default). Rewrites that
+# can be decided from the program text alone:
+#   fold    arithmetic and comparisons on literals, with contract()'s rules
+#   if      an if whose condition is a literal is replaced by its branch
+#   hd, tl  hd and tl of a list cell whose other field is already a value
+#   inline  a let is replaced by its body with the value put in for the
+#           variable, if that costs nothing at runtime: the value is a
+#           number, a variable or # (used any number of times), or it is used
+#           once, and not under a lambda or in a letrec value or fix, where
+#           it could be evaluated again, unless it is a lambda
+#   dead    a let or letrec whose variable the body does not use is replaced
+#           by its body
+# Each of these is a step evaluate() would take itself, so they are only made
+# where it is sure to take them: at the positions it reduces (REDUCE_ORDER,
+# and the body of a let or letrec, which takes the let's place). Lambda
+# bodies, arguments, let values and the branches of an if that is not
+# decided are printed as they are when the evaluator never gets to them, and
+# are left alone, so a program prints the same with and without optimize().
+#
+# binder_uses() counts the uses of every binder in one walk, and the rewrite
+# is a single pass that puts inlined values in and renumbers the variables
+# as it goes, so the whole thing takes time linear in the size of the
+# program. report, if given, counts the rewrites by rule.
+def optimize(tree, report=None):
+    uses = binder_uses(tree)
+    results = []
+    # per binder of tree in scope: its level in the result, or (value, level)
+    # for a let that was inlined (value None if it was dropped)
+    env = []
+    removed = []  # the places in env of the binders that are gone
+    level = 0
+    stack = [("visit", tree, True)]
+    while stack:
+        action, node, evaluated = stack.pop()
+
+        if action == "bind":
+            env.append(level)
+            level += 1
+            continue
+        if action in ("inline", "drop"):
+            removed.append(len(env))
+            env.append((results.pop() if action == "inline" else None, level))
+            continue
+        if action == "unbind":
+            if type(env.pop()) is int:
+                level -= 1
+            elif removed and removed[-1] == len(env):
+                removed.pop()
+            continue
+
+        if action == "build":
+            positions = CHILDREN[node[0]]
+            start = len(results) - len(positions)
+            children = results[start:]
+            del results[start:]
+            new = node
+            if any(child is not node[position] for child, (position, _) in zip(children, positions)):
+                fields = node[:]
+                for child, (position, _) in zip(children, positions):
+                    fields[position] = child
+                new = mk(*fields)
+            results.append(rewrite(new, report) if evaluated else new)
+            continue
+
+        if action == "branch":
+            # the condition of node is done; a literal one decides the branch
+            if results[-1][0] == "num":
+                count_rewrite(report, "if")
+                stack.append(("visit", node[2] if results.pop()[1] != 0 else node[3], True))
+            else:
+                stack.append(("build", node, True))
+                stack.append(("visit", node[3], False))
+                stack.append(("visit", node[2], False))
+            continue
+
+        # visit: a subterm nothing is done to keeps its variables' numbers
+        # if it does not reach past the innermost binder that is gone
+        tag = node[0]
+        if not evaluated and node.loose < len(env) - (removed[-1] if removed else -1):
+            results.append(node)
+            continue
+        if tag == "var":
+            entry = env[len(env) - 1 - node[1]]
+            if type(entry) is int:
+                results.append(mk("var", level - 1 - entry))
+            else:
+                results.append(shift(entry[0], level - entry[1]))
+            continue
+        if evaluated and tag in ("let", "letrec"):
+            count, repeated = uses[node]
+            value = node[2]
+            if count == 0:
+                count_rewrite(report, "dead")
+                stack += [("unbind", None, False), ("visit", node[3], True), ("drop", None, False)]
+                continue
+            if tag == "let" and (value[0] in ("num", "var", "free", "nil")
+                                 or (count == 1 and (not repeated or value[0] == "lam"))):
+                count_rewrite(report, "inline")
+                stack += [("unbind", None, False), ("visit", node[3], True), ("inline", None, False),
+                          ("visit", value, False)]
+                continue
+        if evaluated and tag == "if":
+            stack += [("branch", node, True), ("visit", node[1], True)]
+            continue
+
+        positions = CHILDREN[tag]
+        if not positions:
+            results.append(node)
+            continue
+        stack.append(("build", node, evaluated))
+        reduced = REDUCE_ORDER.get(tag, (3,) if tag in ("let", "letrec") else ())
+        for position, under_binder in reversed(positions):
+            if under_binder:
+                stack.append(("unbind", None, False))
+            stack.append(("visit", node[position], evaluated and position in reduced))
+            if under_binder:
+                stack.append(("bind", None, False))
+    return results[0]
+
+
+def count_rewrite(report, rule):
+    if report is not None:
+        report[rule] = report.get(rule, 0) + 1
+
+
+# the rewrite for a node at a position evaluate() reduces, whose subterms are
+# already optimized
+def rewrite(node, report):
+    tag = node[0]
+    rule = None
+    new = node
+    if tag in ("plus", "minus", "times", "neg", "leq") or (tag == "eq" and is_literal(node[1])
+                                                           and is_literal(node[2])):
+        rule, new = "fold", contract(node)
+    elif tag in ("hd", "tl") and node[1][0] == "cons":
+        # evaluate() reduces both fields first, so the one that is dropped
+        # must not be able to loop or get stuck
+        other = node[1][2] if tag == "hd" else node[1][1]
+        if other[0] in ("lam", "var", "free") or is_literal(other):
+            rule, new = tag, contract(node)
+    if new is not node:
+        count_rewrite(report, rule)
+    return new
+
+
+# a number, # or a list cell of literals, which == can compare as it is
+def is_literal(tree):
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node[0] == "cons":
+            stack.append(node[1])
+            stack.append(node[2])
+        elif node[0] not in ("num", "nil"):
+            return False
+    return True
+
+
+# For every let and letrec in tree: how many times its body uses the variable
+# it binds, and whether a use is under a lambda, in a letrec value or under
+# fix, where it could be evaluated more than once. The binders in scope are
+# kept on a list, so a variable finds its binder without walking up to it;
+# `again` counts the lambdas, letrec values and fixes around a node.
+def binder_uses(tree):
+    found = {}
+    binders = []  # [count, repeated, again] per binder in scope, None if not counted
+    stack = [("visit", tree, 0)]
+    while stack:
+        action, node, again = stack.pop()
+        if action == "bind":
+            binders.append(node)
+            continue
+        if action == "unbind":
+            record = binders.pop()
+            if node is not None:
+                found[node] = (record[0], record[1])
+            continue
+
+        tag = node[0]
+        if tag == "var":
+            record = binders[len(binders) - 1 - node[1]]
+            if record is not None:
+                record[0] += 1
+                if again > record[2]:
+                    record[1] = True
+        elif tag == "lam":
+            stack += [("unbind", None, 0), ("visit", node[2], again + 1), ("bind", None, 0)]
+        elif tag == "let":
+            stack += [("unbind", node, 0), ("visit", node[3], again), ("bind", [0, False, again], 0),
+                      ("visit", node[2], again)]
+        elif tag == "letrec":
+            stack += [("unbind", node, 0), ("visit", node[3], again), ("bind", [0, False, again], 0),
+                      ("unbind", None, 0), ("visit", node[2], again + 1), ("bind", None, 0)]
+        else:
+            inner = again + 1 if tag == "fix" else again
+            stack.extend(("visit", node[position], inner) for position, _ in CHILDREN[tag])
+    return found
+
+
+# Environment machine (backend="machine")
+#
+# Instead of rewriting the whole tree on every step, the machine keeps the
+# term it is currently looking at, an environment for its free variables and
+# an explicit stack of continuation frames. Every transition does a constant
+# amount of work apart from the environment lookup. Arguments are passed
+# unevaluated (call-by-name), just like substitute() does, so the results are
+# the same as the ones produced by evaluate().
+#
+# With share=True (backend="need") the machine is call-by-need instead: when a
+# thunk has been evaluated the cell is overwritten with its value, so every
+# argument, let binding and list element is evaluated at most once no matter
+# how often it is used.
+#
+# letrec and fix do not unroll anything: they create a "rec" cell whose
+# environment points back at the cell itself, so a recursive call is a single
+# environment lookup.
+#
+# An environment is a linked list of (cell, rest) tuples ending in None, so
+# variable k is found k links down. A cell is a list, either ["thunk", term,
+# env] for an unevaluated argument, ["value", value] once it has been shared,
+# ["rec", term, env, name, value] for a recursive binding (value is None until
+# it has been shared), or ("bound", level) for a variable bound by a lambda
+# that is being read back. Values are ("num", n), ("nil",), ("cons", cell,
+# cell), ("clo", lam, env) and ("stuck", term) for terms that cannot reduce
+# any further. Numbers the machine computes are plain tuples rather than
+# interned nodes; readback() and quote() turn them into nodes.
+
+def lookup(env, k):
+    for _ in range(k):
+        env = env[1]
+    return env[0]
+
+
+# the shared value of a cell, or None if it still has to be evaluated
+def cached(cell):
+    kind = cell[0]
+    if kind == "value":
+        return cell[1]
+    if kind == "rec":
+        return cell[4]
+    return None
+
+
+# a cell for fix (\name.term) whose environment contains the cell itself
+def recursive_cell(term, name, env):
+    cell = ["rec", term, None, name, None]
+    cell[2] = (cell, env)
+    return cell
+
+
+# The step budget of the machine (evaluate_machine(..., max_steps=n)): every
+# term run() starts evaluating is a step, counted across the nested runs
+# that force list elements and arguments while reading a value back.
+class Fuel:
+    def __init__(self, max_steps):
+        self.max_steps = max_steps
+        self.steps = 0
+
+    def spend(self, term, env):
+        if self.steps == self.max_steps:
+            raise StepLimitExceeded(f"no value after {self.steps} steps", quote(term, env), self.steps)
+        self.steps += 1
+
+
+def run(term, env, share=False, fuel=None):
+    stack = []
+    while True:
+        if fuel is not None:
+            fuel.spend(term, env)
+        tag = term[0]
+
+        if tag in ("num", "nil"):
+            value = term
+        elif tag == "var":
+            cell = lookup(env, term[1])
+            value = cached(cell)
+            if value is None:
+                if share:
+                    stack.append(("update", cell))
+                term, env = cell[1], cell[2]
+                continue
+        elif tag == "free":
+            value = ("stuck", term)
+        elif tag == "lam":
+            value = ("clo", term, env)
+        elif tag == "app":
+            stack.append(("arg", term[2], env))
+            term = term[1]
+            continue
+        elif tag in ("plus", "minus", "times", "eq", "leq"):
+            stack.append(("right", tag, term[2], env))
+            term = term[1]
+            continue
+        elif tag in ("neg", "hd", "tl"):
+            stack.append((tag,))
+            term = term[1]
+            continue
+        elif tag == "if":
+            stack.append(("if", term[2], term[3], env))
+            term = term[1]
+            continue
+        elif tag == "cons":
+            value = ("cons", ["thunk", term[1], env], ["thunk", term[2], env])
+        elif tag == "let":
+            env = (["thunk", term[2], env], env)
+            term = term[3]
+            continue
+        elif tag == "letrec":
+            env = recursive_cell(term[2], term[1], env)[2]
+            term = term[3]
+            continue
+        elif tag == "fix":
+            stack.append(("fix",))
+            term = term[1]
+            continue
+        elif tag == "prog":
+            stack.append(("prog", term[2], env))
+            term = term[1]
+            continue
+        else:
+            raise Exception("Unknown tree tag in run:", term)
+
+        # hand the value to the innermost continuation frame; a frame that
+        # needs to evaluate something else sets term/env and breaks out
+        while stack:
+            frame = stack.pop()
+            kind = frame[0]
+
+            if kind == "update":
+                cell = frame[1]
+                if cell[0] == "rec":
+                    cell[4] = value
+                else:
+                    cell[:] = ["value", value]
+
+            elif kind == "arg":
+                if value[0] == "clo":
+                    lam, closure_env = value[1], value[2]
+                    env = (["thunk", frame[1], frame[2]], closure_env)
+                    term = lam[2]
+                    break
+                value = ("stuck", mk("app", readback(value, share, fuel), quote(frame[1], frame[2])))
+
+            elif kind == "right":
+                stack.append(("left", frame[1], value))
+                term, env = frame[2], frame[3]
+                break
+
+            elif kind == "left":
+                value = binop(frame[1], frame[2], value, share, fuel)
+
+            elif kind == "neg":
+                if value[0] == "num":
+                    value = ("num", -value[1])
+                else:
+                    value = ("stuck", mk("neg", readback(value, share, fuel)))
+
+            elif kind == "if":
+                if value[0] == "num":
+                    term, env = (frame[1] if value[1] != 0 else frame[2]), frame[3]
+                    break
+                value = ("stuck", mk("if", readback(value, share, fuel), quote(frame[1], frame[3]), quote(frame[2], frame[3])))
+
+            elif kind in ("hd", "tl"):
+                if value[0] == "cons":
+                    cell = value[1] if kind == "hd" else value[2]
+                    if cached(cell) is not None:
+                        value = cached(cell)
+                        continue
+                    if share:
+                        stack.append(("update", cell))
+                    term, env = cell[1], cell[2]
+                    break
+                value = ("stuck", mk(kind, readback(value, share, fuel)))
+
+            elif kind == "prog":
+                stack.append(("prog done", readback(value, share, fuel)))
+                term, env = frame[1], frame[2]
+                break
+
+            elif kind == "prog done":
+                value = ("stuck", mk("prog", frame[1], readback(value, share, fuel)))
+
+            elif kind == "fix":
+                if value[0] == "clo":
+                    lam = value[1]
+                    cell = recursive_cell(lam[2], lam[1], value[2])
+                    if share:
+                        stack.append(("update", cell))
+                    term, env = cell[1], cell[2]
+                    break
+                value = ("stuck", mk("fix", readback(value, share, fuel)))
+
+        else:
+            return value
+
+
+def binop(op, left, right, share, fuel=None):
+    if op == "eq":
+        a, b = readback(left, share, fuel), readback(right, share, fuel)
+        if a[0] in ("num", "nil", "cons") and b[0] in ("num", "nil", "cons"):
+            return ("num", 1 if eqv(a, b) else 0)
+        return ("stuck", mk("eq", a, b))
+
+    if left[0] == "num" and right[0] == "num":
+        if op == "plus":
+            return ("num", left[1] + right[1])
+        if op == "minus":
+            return ("num", left[1] - right[1])
+        if op == "times":
+            return ("num", left[1] * right[1])
+        if op == "leq":
+            return ("num", 1 if left[1] <= right[1] else 0)
+    return ("stuck", mk(op, readback(left, share, fuel), readback(right, share, fuel)))
+
+
+def force(cell, share, fuel=None):
+    value = cached(cell)
+    if value is not None:
+        return value
+    value = run(cell[1], cell[2], share, fuel)
+    if share:
+        cell[:] = ["value", value]
+    return value
+
+
+def normalize(term, env, share=False, fuel=None):
+    return readback(run(term, env, share, fuel), share, fuel)
+
+
+# turn a value back into a term in the same normal form evaluate() reaches;
+# list elements are forced one after the other, head first
+def readback(value, share=False, fuel=None):
+    results = []
+    stack = [value]
+    while stack:
+        item = stack.pop()
+
+        if item is None:
+            t = results.pop()
+            h = results.pop()
+            results.append(mk("cons", h, t))
+            continue
+
+        if type(item) is list:
+            item = force(item, share, fuel)
+
+        tag = item[0]
+        if tag in ("num", "nil"):
+            results.append(item if type(item) is Node else mk(*item))
+        elif tag == "cons":
+            stack.append(None)
+            stack.append(item[2])
+            stack.append(item[1])
+        elif tag == "clo":
+            results.append(quote(item[1], item[2]))
+        elif tag == "stuck":
+            results.append(item[1])
+        else:
+            raise Exception("Unknown value in readback:", item)
+
+    return results[0]
+
+
+# substitute the (unevaluated) arguments stored in env back into term; depth
+# counts the binders quote() has already gone under. Nothing is evaluated, so
+# arguments and list elements that have not been forced yet stay as they are.
+def quote(term, env, depth=0):
+    def leaf(node, ctx):
+        if node[0] != "var":
+            return node
+        env, depth = ctx
+        cell = lookup(env, node[1])
+        kind = cell[0]
+
+        if kind == "bound":
+            return mk("var", depth - 1 - cell[1])
+
+        if kind == "thunk":
+            return [cell[1], (cell[2], depth)]
+
+        if kind == "rec":
+            # read back as fix (\f.v), with f bound inside instead of pointing
+            # at the cell again
+            return [mk("fix", mk("lam", cell[3], cell[1])), (cell[2][1], depth)]
+
+        value = cell[1]
+        if value[0] in ("num", "nil"):
+            return value if type(value) is Node else mk(*value)
+        if value[0] == "cons":
+            return [mk("cons", mk("var", 0), mk("var", 1)), ((value[1], (value[2], None)), depth)]
+        if value[0] == "clo":
+            return [value[1], (value[2], depth)]
+        return value[1]
+
+    def enter(node, ctx):
+        env, depth = ctx
+        return node[:2], ((("bound", depth), env), depth + 1)
+
+    # a closed subterm has nothing to substitute
+    return rebuild(term, (env, depth), leaf, enter, keep=lambda node, ctx: node.loose == 0)
+
+
+def evaluate_machine(tree, share=False, max_steps=None):
+    return normalize(tree, None, share, Fuel(max_steps) if max_steps is not None else None)
 
 
 class NameGenerator:
@@ -328,161 +1124,368 @@ class NameGenerator:
         return "Var" + str(self.counter)
 
 
-name_generator = NameGenerator()
-
-
-def substitute(tree, name, replacement):
-    tag = tree[0]
+def free_names(tree):
+    names = set()
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node[0] == "free":
+            names.add(node[1])
+        else:
+            stack.extend(node[position] for position, _ in CHILDREN[node[0]])
+    return names
+
+
+# give every binder a name again: the original one when nothing it would
+# capture is in scope, otherwise a fresh Var<n>, counted in stats if given
+def from_debruijn(tree, stats=None):
+    avoid = free_names(tree)
+    in_scope = {}
+    name_generator = NameGenerator()
+
+    # the scope is a linked list (name, rest) with the innermost binder first
+    def leaf(node, scope):
+        if node[0] == "var":
+            for _ in range(node[1]):
+                scope = scope[1]
+            return mk("var", scope[0])
+        if node[0] == "free":
+            return mk("var", node[1])
+        return node
+
+    def enter(node, scope):
+        name = node[1]
+        while in_scope.get(name) or name in avoid:
+            name = name_generator.generate()
+        in_scope[name] = in_scope.get(name, 0) + 1
+        return (node[0], name), (name, scope)
+
+    def leave(head):
+        in_scope[head[1]] -= 1
+
+    tree = rebuild(tree, None, leaf, enter, leave)
+    if stats is not None:
+        stats.fresh_names += name_generator.counter
+    return tree
+
+
+# exact=False prints every number as a float (120.0), as the interpreter
+# always has and testing-data.txt expects; exact=True prints ints as ints
+def linearize(ast, exact=False, stats=None):
+    return linearize_named(from_debruijn(ast, stats), exact)
+
+
+def number_text(n, exact):
+    if exact or type(n) is float:
+        return str(n)
+    try:
+        return str(float(n))
+    except OverflowError:
+        return str(n)
+
+
+# the pieces each node is printed as; tuples in the list are printed in turn
+def layout(ast, exact=False):
+    tag = ast[0]
 
     if tag == "var":
-        return replacement if tree[1] == name else tree
+        return [ast[1]]
+
+    if tag == "num":
+        return [number_text(ast[1], exact)]
 
     if tag == "lam":
-        bound, body = tree[1], tree[2]
-        if bound == name:
-            return tree
-        fresh = name_generator.generate()
-        renamed = substitute(body, bound, ("var", fresh))
-        return ("lam", fresh, substitute(renamed, name, replacement))
+        return ["(\\" + ast[1] + ".", ast[2], ")"]
 
     if tag == "app":
-        return ("app", substitute(tree[1], name, replacement), substitute(tree[2], name, replacement))
+        return ["(", ast[1], " ", ast[2], ")"]
 
-    if tag == "num":
-        return tree
+    if tag == "plus":
+        return ["(", ast[1], " + ", ast[2], ")"]
 
-    if tag in ("plus", "minus", "times"):
-        return (tag, substitute(tree[1], name, replacement), substitute(tree[2], name, replacement))
+    if tag == "minus":
+        return ["(", ast[1], " - ", ast[2], ")"]
+
+    if tag == "times":
+        return ["(", ast[1], " * ", ast[2], ")"]
 
     if tag == "neg":
-        return ("neg", substitute(tree[1], name, replacement))
+        return ["-", ast[1]]
 
     if tag == "if":
-        return ("if",
-                substitute(tree[1], name, replacement),
-                substitute(tree[2], name, replacement),
-                substitute(tree[3], name, replacement))
+        return ["(if ", ast[1], " then ", ast[2], " else ", ast[3], ")"]
 
     if tag == "let":
-        x, v, body = tree[1], tree[2], tree[3]
-        nv = substitute(v, name, replacement)
-        if x == name:
-            return ("let", x, nv, body)
-        return ("let", x, nv, substitute(body, name, replacement))
+        return ["(let " + ast[1] + " = ", ast[2], " in ", ast[3], ")"]
 
     if tag == "letrec":
-        f, v, body = tree[1], tree[2], tree[3]
-        if f == name:
-            return tree
-        return ("letrec", f, substitute(v, name, replacement), substitute(body, name, replacement))
+        return ["(letrec " + ast[1] + " = ", ast[2], " in ", ast[3], ")"]
 
     if tag == "eq":
-        return ("eq", substitute(tree[1], name, replacement), substitute(tree[2], name, replacement))
+        return ["(", ast[1], " == ", ast[2], ")"]
 
     if tag == "leq":
-        return ("leq", substitute(tree[1], name, replacement), substitute(tree[2], name, replacement))
+        return ["(", ast[1], " <= ", ast[2], ")"]
 
     if tag == "nil":
-        return tree
+        return ["#"]
 
     if tag == "cons":
-        return ("cons", substitute(tree[1], name, replacement), substitute(tree[2], name, replacement))
+        return ["(", ast[1], " : ", ast[2], ")"]
 
     if tag == "hd":
-        return ("hd", substitute(tree[1], name, replacement))
+        return ["(hd ", ast[1], ")"]
 
     if tag == "tl":
-        return ("tl", substitute(tree[1], name, replacement))
+        return ["(tl ", ast[1], ")"]
 
     if tag == "prog":
-        return ("prog", substitute(tree[1], name, replacement), substitute(tree[2], name, replacement))
+        return [ast[1], " ;; ", ast[2]]
 
     if tag == "fix":
-        return ("fix", substitute(tree[1], name, replacement))
-
-    raise Exception("Unknown tree tag in substitute:", tree)
-
-
-def linearize(ast):
-    tag = ast[0]
-
-    if tag == "var":
-        return ast[1]
-
-    if tag == "num":
-        return str(ast[1])
-
-    if tag == "lam":
-        return "(\\" + ast[1] + "." + linearize(ast[2]) + ")"
-
-    if tag == "app":
-        return "(" + linearize(ast[1]) + " " + linearize(ast[2]) + ")"
+        return ["(fix ", ast[1], ")"]
 
-    if tag == "plus":
-        return "(" + linearize(ast[1]) + " + " + linearize(ast[2]) + ")"
-
-    if tag == "minus":
-        return "(" + linearize(ast[1]) + " - " + linearize(ast[2]) + ")"
-
-    if tag == "times":
-        return "(" + linearize(ast[1]) + " * " + linearize(ast[2]) + ")"
-
-    if tag == "neg":
-        return "-" + linearize(ast[1])
+    return [str(ast)]
 
-    if tag == "if":
-        return "(if " + linearize(ast[1]) + " then " + linearize(ast[2]) + " else " + linearize(ast[3]) + ")"
 
-    if tag == "let":
-        return "(let " + ast[1] + " = " + linearize(ast[2]) + " in " + linearize(ast[3]) + ")"
+def linearize_named(ast, exact=False):
+    out = []
+    stack = [ast]
+    while stack:
+        item = stack.pop()
+        if type(item) is str:
+            out.append(item)
+        else:
+            stack.extend(reversed(layout(item, exact)))
+    return "".join(out)
 
-    if tag == "letrec":
-        return "(letrec " + ast[1] + " = " + linearize(ast[2]) + " in " + linearize(ast[3]) + ")"
 
-    if tag == "eq":
-        return "(" + linearize(ast[1]) + " == " + linearize(ast[2]) + ")"
+BACKENDS = ("reduce", "machine", "need", "closure", "bytecode")
+# the backends max_steps can be given to: the closure and bytecode backends
+# run compiled code that does not count its steps, and only reduce builds the
+# term whose size max_size limits
+STEP_LIMIT_BACKENDS = ("reduce", "machine", "need")
 
-    if tag == "leq":
-        return "(" + linearize(ast[1]) + " <= " + linearize(ast[2]) + ")"
 
-    if tag == "nil":
-        return "#"
+def to_ast(source_code, exact=False):
+    return to_debruijn(get_parser().parse(source_code), exact)
 
-    if tag == "cons":
-        return "(" + linearize(ast[1]) + " : " + linearize(ast[2]) + ")"
 
-    if tag == "hd":
-        return "(hd " + linearize(ast[1]) + ")"
+# What an interpret() call did, filled in when it is passed as stats=. The
+# counts come from the reduce backend; the phase times from every backend.
+class Stats:
+    def __init__(self):
+        self.steps = 0
+        self.beta = 0
+        self.delta = {}  # reductions other than beta, by the tag of the redex
+        self.substitute = 0
+        self.fresh_names = 0
+        self.peak_size = 0
+        self.peak_depth = 0
+        self.rewrites = {}  # made by optimize() (see its report)
+        self.fallback = None  # why run_backend() fell back to need, if it did
+        self.seconds = {}  # parse, transform, optimize, evaluate and linearize
+
+    # count a reduction step that contracted the redex tree
+    def contracted(self, tree):
+        if tree[0] == "app":
+            self.beta += 1
+        else:
+            self.delta[tree[0]] = self.delta.get(tree[0], 0) + 1
+
+    def record(self, tree):
+        self.record_measures(tree.size, tree.depth)
+
+    # record() for a term that is not built, of the given size and depth
+    def record_measures(self, size, depth):
+        if size > self.peak_size:
+            self.peak_size = size
+        if depth > self.peak_depth:
+            self.peak_depth = depth
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+# max_steps, max_size and strategy are passed on to run_backend(); exact keeps whole numbers as ints (see to_debruijn()) and prints
+# them as ints; memo is a Memo for the closure backend; opt=False skips
+# optimize(); fallback is passed on to run_backend()
+def interpret(source_code: str, backend: str = "reduce", max_steps: int = None, max_size: int = None,
+              stats: Stats = None, exact: bool = False, memo: Memo = None, strategy: str = "weak",
+              opt: bool = True, fallback: bool = True) -> str:
+    if stats is None:
+        ast = to_ast(source_code, exact)
+        if opt:
+            ast = optimize(ast)
+        return linearize(run_backend(ast, backend, max_steps, max_size, memo=memo, strategy=strategy,
+                                     fallback=fallback), exact)
+
+    start = time.perf_counter()
+    tree = get_parser().parse(source_code)
+    stats.seconds["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ast = to_debruijn(tree, exact)
+    stats.seconds["transform"] = time.perf_counter() - start
+
+    if opt:
+        start = time.perf_counter()
+        ast = optimize(ast, stats.rewrites)
+        stats.seconds["optimize"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        result_ast = run_backend(ast, backend, max_steps, max_size, stats, memo, strategy, fallback)
+    finally:
+        stats.seconds["evaluate"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = linearize(result_ast, exact, stats)
+    stats.seconds["linearize"] = time.perf_counter() - start
+    return result
+
+
+# A program the closure or bytecode backend cannot run (see Unsupported) is
+# run on the need backend instead, with a note on stderr and the reason in
+# stats.fallback; fallback=False raises the Unsupported error instead.
+def run_backend(ast, backend, max_steps=None, max_size=None, stats=None, memo=None, strategy="weak",
+                fallback=True):
+    if memo is not None and backend != "closure":
+        raise ValueError("memoization needs the closure backend")
+    if strategy not in STRATEGIES:
+        raise ValueError("Unknown strategy: " + str(strategy))
+    if strategy != "weak" and backend != "reduce":
+        raise ValueError("a strategy other than weak needs the reduce backend")
+    if max_size is not None and backend != "reduce":
+        raise ValueError("a size limit needs the reduce backend")
+    if max_steps is not None and backend not in STEP_LIMIT_BACKENDS:
+        raise ValueError("a step limit needs the reduce, machine or need backend")
+    if backend == "reduce":
+        result_ast = evaluate(ast, max_steps, max_size, stats, strategy)
+    elif backend == "machine":
+        result_ast = evaluate_machine(ast, max_steps=max_steps)
+    elif backend == "need":
+        result_ast = evaluate_machine(ast, share=True, max_steps=max_steps)
+    elif backend in ("closure", "bytecode"):
+        try:
+            if backend == "closure":
+                result_ast = evaluate_closure(ast, memo)
+            else:
+                result_ast = run_program(compile_program(ast))
+        except Unsupported as e:
+            if not fallback:
+                raise
+            print(f"{backend} backend: {e}; running on the need backend instead", file=sys.stderr)
+            if stats is not None:
+                stats.fallback = str(e)
+            result_ast = evaluate_machine(ast, share=True)
+    else:
+        raise ValueError("Unknown backend: " + backend)
+    return result_ast
 
-    if tag == "tl":
-        return "(tl " + linearize(ast[1]) + ")"
 
-    if tag == "prog":
-        return linearize(ast[1]) + " ;; " + linearize(ast[2])
+# server.py, loaded from SERVER_PATH when --server is given: importing this
+# module does not touch sys.path, and no other module named server can be
+# picked up in its place
+def load_server():
+    spec = importlib.util.spec_from_file_location("lambda_server", SERVER_PATH)
+    server = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(server)
+    return server
 
-    if tag == "fix":
-        return "(fix " + linearize(ast[1]) + ")"
 
-    return str(ast)
+# the source code in arg, or in the file arg names
+def read_program(arg):
+    if os.path.isfile(arg):
+        with open(arg) as f:
+            return f.read()
+    return arg
 
 
-def interpret(source_code: str) -> str:
-    cst = parser.parse(source_code)
-    ast = LambdaCalculusTransformer().transform(cst)
-    result_ast = evaluate(ast)
-    return linearize(result_ast)
+def handle_request(request):
+    if request["backend"] not in BACKENDS:
+        raise ValueError("Unknown backend: " + str(request["backend"]))
+    memo = Memo(request["memo"]) if request["memo"] else None
+    return interpret(request["program"], backend=request["backend"],
+                     max_steps=request["max_steps"], max_size=request["max_size"], exact=request["exact"],
+                     memo=memo, strategy=request["strategy"], opt=request["opt"], fallback=request["fallback"])
 
 
 def main():
-    if len(sys.argv) != 2:
-        sys.exit(1)
-    arg = sys.argv[1]
-    if os.path.isfile(arg):
-        with open(arg) as f:
-            expr = f.read()
+    arg_parser = argparse.ArgumentParser(description="Evaluate a lambda calculus program.")
+    arg_parser.add_argument("program", nargs="?", help="source code or the name of a file containing it")
+    arg_parser.add_argument("--backend", choices=BACKENDS, default="reduce",
+                            help="evaluation engine (need = call-by-need with sharing, "
+                                 "closure = compiled to Python closures, "
+                                 "bytecode = compiled for a stack machine)")
+    arg_parser.add_argument("--server", action="store_true",
+                            help="answer JSON-lines requests from stdin (see server.py)")
+    arg_parser.add_argument("--socket", help="with --server, listen on this Unix socket instead")
+    arg_parser.add_argument("--max-steps", type=int,
+                            help="reduction step limit (reduce, machine and need backends)")
+    arg_parser.add_argument("--max-size", type=int, help="term size limit in nodes (reduce backend)")
+    arg_parser.add_argument("--timeout", type=float, help="with --server, default time limit per request in seconds")
+    arg_parser.add_argument("--stats", action="store_true", help="print evaluation statistics as JSON to stderr")
+    arg_parser.add_argument("--exact", action="store_true", help="print whole numbers as ints (120, not 120.0)")
+    arg_parser.add_argument("--memo", type=int, metavar="SIZE",
+                            help="closure backend: remember up to SIZE results of functions applied to numbers")
+    arg_parser.add_argument("--strategy", choices=STRATEGIES, default="weak",
+                            help="reduce backend: how far to reduce (whnf = weak head normal form, "
+                                 "hnf = head normal form, nf = full normal form, cbv = call by value)")
+    arg_parser.add_argument("--no-opt", dest="opt", action="store_false",
+                            help="evaluate the program as written, without optimizing it first")
+    arg_parser.add_argument("--opt-report", action="store_true",
+                            help="print the rewrites made by the optimizer as JSON to stderr")
+    arg_parser.add_argument("--no-fallback", dest="fallback", action="store_false",
+                            help="closure and bytecode backends: fail on a program they cannot run, "
+                                 "instead of running it on the need backend")
+    # a program starting with "-", such as -(1+2), looks like an option and
+    # is left over by argparse
+    args, extra = arg_parser.parse_known_args()
+    if len(extra) == 1 and args.program is None and not extra[0].startswith("--"):
+        args.program = extra[0]
+    elif extra:
+        arg_parser.error("unrecognized arguments: " + " ".join(extra))
+
+    if args.server:
+        server = load_server()
+        defaults = {"backend": args.backend, "max_steps": args.max_steps, "max_size": args.max_size,
+                    "timeout": args.timeout, "exact": args.exact, "memo": args.memo,
+                    "strategy": args.strategy, "opt": args.opt, "fallback": args.fallback}
+        if args.socket:
+            server.serve_socket(args.socket, handle_request, defaults)
+        else:
+            server.serve(sys.stdin, sys.stdout, handle_request, defaults)
+    elif args.program is None:
+        arg_parser.error("a program is needed unless --server is given")
+    elif args.memo and args.backend != "closure":
+        arg_parser.error("--memo needs --backend closure")
+    elif args.strategy != "weak" and args.backend != "reduce":
+        arg_parser.error("--strategy needs --backend reduce")
+    elif args.max_size is not None and args.backend != "reduce":
+        arg_parser.error("--max-size needs --backend reduce")
+    elif args.max_steps is not None and args.backend not in STEP_LIMIT_BACKENDS:
+        arg_parser.error("--max-steps needs --backend reduce, machine or need")
     else:
-        expr = arg
-    print(interpret(expr))
+        stats = Stats() if args.stats or args.opt_report else None
+        memo = Memo(args.memo) if args.memo else None
+        try:
+            print(interpret(read_program(args.program), backend=args.backend,
+                            max_steps=args.max_steps, max_size=args.max_size, stats=stats,
+                            exact=args.exact, memo=memo, strategy=args.strategy, opt=args.opt,
+                            fallback=args.fallback))
+        except LimitExceeded as e:
+            sys.exit(str(e))
+        except Unsupported as e:
+            sys.exit(f"{args.backend} backend: {e}")
+        finally:
+            if args.stats:
+                counts = stats.as_dict()
+                if memo is not None:
+                    counts["memo"] = memo.as_dict()
+                print(json.dumps(counts), file=sys.stderr)
+            elif args.opt_report:
+                print(json.dumps(stats.rewrites), file=sys.stderr)
 
 
 if __name__ == "__main__":
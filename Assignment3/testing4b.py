@@ -1,10 +1,21 @@
 # https://codeberg.org/alexhkurz/testing-python-programs/src/branch/main/testing4b.py
+# Usage: python testing4b.py [--in-process]
+#
+# --in-process imports each program and calls its interpret() function
+# directly, spreading the tests over a pool of processes. Instead of a
+# timeout, a test gets STEP_BUDGET reduction steps and terms of at most
+# SIZE_BUDGET nodes, so the results do not depend on how busy the machine is.
 import os
 import subprocess
 import re
 import glob
+import importlib.util
+import multiprocessing
+import sys
 
 TIMEOUT = 0.2  # Timeout duration in seconds
+STEP_BUDGET = 100000  # Reduction steps per test with --in-process
+SIZE_BUDGET = 1000000  # Term size in nodes with --in-process
 
 def load_tests(file_path):
     tests = []
@@ -21,6 +32,30 @@ def run_test(program, input):
     except subprocess.TimeoutExpired:
         return "TIMEOUT", ""
 
+# programs imported as modules, by path
+loaded_programs = {}
+
+def load_program(path):
+    if path not in loaded_programs:
+        # the program imports its own helper modules from its directory
+        sys.path.insert(0, os.path.dirname(path))
+        name = os.path.splitext(os.path.basename(path))[0]
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        loaded_programs[path] = module
+    return loaded_programs[path]
+
+def run_test_in_process(test):
+    path, input = test
+    module = load_program(path)
+    try:
+        return module.interpret(input, max_steps=STEP_BUDGET, max_size=SIZE_BUDGET), ""
+    except module.LimitExceeded:
+        return "TIMEOUT", ""
+    except Exception as e:
+        return "", f"{type(e).__name__}: {e}"
+
 def remove_ansi_escape_sequences(text):
     ansi_escape = re.compile(r'\x1B[@-_][0-?]*[ -/]*[@-~]')
     return ansi_escape.sub('', text)
@@ -53,34 +88,57 @@ def rename_variables_in_output(output):
     renamed_tokens = [renamer.get_fresh_name(token) if re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', token) else token for token in tokens]
     return ''.join(renamed_tokens)
 
+def write_result(result_file, name, input, expected_output, output, error):
+    clean_output = remove_ansi_escape_sequences(output)
+    # rename bound variables in lambda calculus terms
+    renamed_clean_output = rename_variables_in_output(clean_output)
+    renamed_expected_output = rename_variables_in_output(expected_output)
+    if renamed_clean_output == renamed_expected_output:
+        result_file.write(f"True | {name} | Input: {input} | Expected: {expected_output} | Output: {clean_output} \n")
+    elif output == "TIMEOUT":
+        result_file.write(f"TIMEOUT | {name} | Input: {input} | Expected: {expected_output} | Output: {output}\n")
+    else:
+        try:
+            result_file.write(f"{float(output) == float(expected_output)} | {name} | Input: {input} | Expected: {expected_output} | Output: {output}\n")
+        except ValueError:
+            result_file.write(f"False | {name} | Input: {input} | Expected: {expected_output} | Output: {clean_output}\n")
+    if error:
+        result_file.write(f"Error: {error}\n")
+
+def main_in_process(script_dir, tests):
+    jobs = []
+    for program in sorted(os.listdir(script_dir)):
+        if program.endswith(".py"):
+            for (name, input, expected_output) in tests:
+                if program.endswith(f"{name}.py"):
+                    jobs.append((program, name, input, expected_output))
+    paths = [os.path.join(script_dir, program) for program in sorted({job[0] for job in jobs})]
+    for path in paths:
+        load_program(path)  # once, before the workers are forked
+    with multiprocessing.Pool(os.cpu_count()) as pool:
+        results = pool.map(run_test_in_process, [(os.path.join(script_dir, job[0]), job[2]) for job in jobs])
+    for (program, name, input, expected_output), (output, error) in zip(jobs, results):
+        result_file_path = os.path.join(script_dir, f"{program}.txt")
+        with open(result_file_path, 'a') as result_file:
+            write_result(result_file, name, input, expected_output, output, error)
+
 def main():
     remove_old_py_txt_files()
     script_dir = os.path.dirname(os.path.abspath(__file__))
     tests_path = os.path.join(script_dir, "testing-data.txt")
     tests = load_tests(tests_path)
+    if "--in-process" in sys.argv[1:]:
+        main_in_process(script_dir, tests)
+        return
     for program in os.listdir(script_dir):
         if program.endswith(f".py"):  # only test Python files
             for (name, input, expected_output) in tests:
                 if program.endswith(f"{name}.py"):  # only apply tests that match the name
                     print(f"Processing \033[95m{program}\033[0m on \033[95m{input}\033[0m")
                     output, error = run_test(program, input)
-                    clean_output = remove_ansi_escape_sequences(output)
                     result_file_path = os.path.join(script_dir, f"{program}.txt")
                     with open(result_file_path, 'a') as result_file:
-                        # rename bound variables in lambda calculus terms
-                        renamed_clean_output = rename_variables_in_output(clean_output)
-                        renamed_expected_output = rename_variables_in_output(expected_output)
-                        if renamed_clean_output == renamed_expected_output:
-                            result_file.write(f"True | {name} | Input: {input} | Expected: {expected_output} | Output: {clean_output} \n")
-                        elif output == "TIMEOUT":
-                            result_file.write(f"TIMEOUT | {name} | Input: {input} | Expected: {expected_output} | Output: {output}\n")
-                        else:
-                            try:
-                                result_file.write(f"{float(output) == float(expected_output)} | {name} | Input: {input} | Expected: {expected_output} | Output: {output}\n")
-                            except ValueError:
-                                result_file.write(f"False | {name} | Input: {input} | Expected: {expected_output} | Output: {clean_output}\n")
-                        if error:
-                            result_file.write(f"Error: {error}\n")
+                        write_result(result_file, name, input, expected_output, output, error)
     
 if __name__ == "__main__":
     main()
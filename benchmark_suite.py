@@ -0,0 +1,226 @@
+"""
+benchmark_suite.py
+
+Usage:
+    python benchmark_suite.py run [-o results.json] [--workloads NAME ...] [--backend reduce]
+    python benchmark_suite.py compare baseline.json results.json [--threshold 0.25] [--min-ms 5]
+
+run measures every workload at each of its sizes: the reduction steps (for
+the interpreters' reduce engines), the best wall time of a few runs and the
+peak memory allocated by Python during one run (with tracemalloc). The
+results are printed and saved as JSON. --backend picks the Assignment3
+backend; steps are only counted by reduce. Assignment3 programs are run
+without optimize(), so the steps are those of the program as written.
+
+compare lists the workloads whose time or peak memory grew by more than
+--threshold (a fraction) or whose step count changed, and exits with status
+1 if there are any. Time differences under --min-ms are taken as noise.
+
+Each program is measured in a process of its own, as the two interpreters
+have modules with the same names.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PROGRAMS = {
+    "calculator_cfg": os.path.join(HERE, "Assignment1", "calculator_cfg.py"),
+    "Assignment2": os.path.join(HERE, "Assignment2", "interpreter.py"),
+    "Assignment3": os.path.join(HERE, "Assignment3", "interpreter.py"),
+}
+
+REPEAT = 5
+
+
+def church(n):
+    return r"(\f.\x." + "f (" * n + "x" + ")" * n + ")"
+
+
+CHURCH_ADD = r"(\m.\n.\f.\x.m f (n f x))"
+CHURCH_MUL = r"(\m.\n.\f.m (n f))"
+
+
+def expressions(n):
+    rng = random.Random(n)
+    items = []
+    for _ in range(n):
+        expr = str(rng.randint(1, 9))
+        for _ in range(rng.randint(1, 8)):
+            expr = f"({expr}){rng.choice('+-*')}{rng.randint(1, 9)}"
+        items.append(expr)
+    return items
+
+
+# (n - 1 would parse as the application n (-1))
+FACT = r"letrec fact = \n. if n == 0 then 1 else n * (fact (n + -1)) in fact {n}"
+SUM = r"letrec sum = \n. if n == 0 then 0 else n + (sum (n + -1)) in sum {n}"
+FIB = r"letrec fib = \n. if n <= 1 then n else (fib (n + -1)) + (fib (n + -2)) in fib {n}"
+LIST = (r"letrec build = \n. if n == 0 then # else n : (build (n + -1)) in "
+        r"letrec len = \xs. if xs == # then 0 else 1 + (len (tl xs)) in "
+        r"let xs = build {n} in (hd xs) + (len xs)")
+# two lists built at run time, equal but for the last cell, so that == has to
+# compare every cell and the optimizer cannot decide it from the source
+EQ_LISTS = (r"letrec build = \n. \last. if n == 0 then last : # else n : (build (n + -1) last) in "
+            r"(build {n} 0) == (build {n} 1)")
+
+
+def let_chain(n):
+    return "let x0 = 1 in " + "".join(f"let x{i} = x{i - 1} + 1 in " for i in range(1, n + 1)) + f"x{n}"
+
+
+# workload name -> (program, {size: input})
+WORKLOADS = {
+    "church add": ("Assignment2", {n: f"{CHURCH_ADD} {church(n)} {church(n)}" for n in (5, 10, 20)}),
+    "church mul": ("Assignment2", {n: f"{CHURCH_MUL} {church(n)} {church(n)}" for n in (3, 5, 8)}),
+    "church exp": ("Assignment2", {n: f"{church(n)} {church(2)}" for n in (2, 3, 4)}),
+    "fact": ("Assignment3", {n: FACT.format(n=n) for n in (5, 10, 20)}),
+    "sum": ("Assignment3", {n: SUM.format(n=n) for n in (5, 10, 20)}),
+    "fib": ("Assignment3", {n: FIB.format(n=n) for n in (5, 8, 10)}),
+    "list hd/tl": ("Assignment3", {n: LIST.format(n=n) for n in (4, 7, 10)}),
+    "let chain": ("Assignment3", {n: let_chain(n) for n in (10, 100, 300)}),
+    "eq lists": ("Assignment3", {n: EQ_LISTS.format(n=n) for n in (10, 30, 100)}),
+    "expression batch": ("calculator_cfg", {n: expressions(n) for n in (100, 1000)}),
+}
+
+
+def load_program(path):
+    # the program imports its own helper modules from its directory
+    sys.path.insert(0, os.path.dirname(path))
+    spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(path))[0], path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# a function running one input, returning its step count or None
+def runner(program, module, backend):
+    if program == "calculator_cfg":
+        # the --batch path: each line parsed, compiled and run, with a cache
+        # that starts out empty every time
+        evaluator = module.BatchEvaluator(cache_size=10000)
+
+        def run(batch):
+            evaluator.compiled.cache_clear()
+            evaluator.run_lines(batch)
+        return run
+
+    def run(source):
+        stats = module.Stats()
+        if program == "Assignment3":
+            # without the optimizer, which would fold some workloads away
+            module.interpret(source, backend=backend, stats=stats, opt=False)
+        else:
+            module.interpret(source, stats=stats)
+        return stats.steps if program == "Assignment2" or backend == "reduce" else None
+    return run
+
+
+def measure(program, names, backend):
+    module = load_program(PROGRAMS[program])
+    run = runner(program, module, backend)
+    results = []
+    for name in names:
+        for size, source in WORKLOADS[name][1].items():
+            best = None
+            for _ in range(REPEAT):
+                start = time.perf_counter()
+                steps = run(source)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            tracemalloc.start()
+            run(source)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append({"workload": name, "size": size, "steps": steps, "seconds": best, "peak_bytes": peak})
+    return results
+
+
+def run_suite(names, backend, output):
+    results = []
+    for program in PROGRAMS:
+        selected = [name for name in names if WORKLOADS[name][0] == program]
+        if not selected:
+            continue
+        command = [sys.executable, os.path.abspath(__file__), "measure", program, "--backend", backend,
+                   "--workloads", *selected]
+        child = subprocess.run(command, check=True, capture_output=True, text=True)
+        for result in json.loads(child.stdout):
+            result["program"] = program
+            results.append(result)
+            steps = "-" if result["steps"] is None else result["steps"]
+            print(f"{result['workload']:<18} {result['size']:>6} {steps:>10} "
+                  f"{result['seconds'] * 1000:10.2f} ms {result['peak_bytes'] / 1024:10.1f} KiB")
+    with open(output, "w") as f:
+        json.dump({"backend": backend, "results": results}, f, indent=1)
+    print(f"saved {output}")
+
+
+def compare(baseline_path, results_path, threshold, min_seconds):
+    with open(baseline_path) as f:
+        saved = json.load(f)
+    with open(results_path) as f:
+        current = json.load(f)
+    if saved["backend"] != current["backend"]:
+        print(f"note: the baseline used the {saved['backend']} backend, the results {current['backend']}")
+    baseline = {(r["workload"], r["size"]): r for r in saved["results"]}
+    results = current["results"]
+
+    regressions = 0
+    for result in results:
+        old = baseline.get((result["workload"], result["size"]))
+        if old is None:
+            continue
+        notes = []
+        if result["steps"] != old["steps"]:
+            notes.append(f"steps {old['steps']} -> {result['steps']}")
+        for key, unit, scale in (("seconds", "ms", 1000), ("peak_bytes", "KiB", 1 / 1024)):
+            if key == "seconds" and result[key] - old[key] < min_seconds:
+                continue
+            if result[key] > old[key] * (1 + threshold):
+                notes.append(f"{key} {old[key] * scale:.1f} -> {result[key] * scale:.1f} {unit} "
+                             f"(+{(result[key] / old[key] - 1) * 100:.0f}%)")
+        if notes:
+            regressions += 1
+            print(f"REGRESSION {result['workload']} {result['size']}: " + ", ".join(notes))
+    print(f"{regressions} regression(s) in {len(results)} measurements")
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark suite for the calculator and the interpreters.")
+    sub = arg_parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="run the workloads and save the results")
+    run.add_argument("-o", "--output", default="benchmark-results.json")
+    run.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=list(WORKLOADS))
+    run.add_argument("--backend", default="reduce", help="Assignment3 backend")
+    compare_cmd = sub.add_parser("compare", help="compare results with a saved baseline")
+    compare_cmd.add_argument("baseline")
+    compare_cmd.add_argument("results")
+    compare_cmd.add_argument("--threshold", type=float, default=0.25)
+    compare_cmd.add_argument("--min-ms", type=float, default=5.0)
+    # used by run, in a new process for each program
+    measure_cmd = sub.add_parser("measure")
+    measure_cmd.add_argument("program", choices=PROGRAMS)
+    measure_cmd.add_argument("--workloads", nargs="+", choices=WORKLOADS, required=True)
+    measure_cmd.add_argument("--backend", default="reduce")
+    args = arg_parser.parse_args()
+
+    if args.command == "run":
+        run_suite(args.workloads, args.backend, args.output)
+    elif args.command == "compare":
+        if compare(args.baseline, args.results, args.threshold, args.min_ms / 1000):
+            sys.exit(1)
+    elif args.command == "measure":
+        print(json.dumps(measure(args.program, args.workloads, args.backend)))
+
+
+if __name__ == "__main__":
+    main()
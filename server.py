@@ -0,0 +1,93 @@
+"""
+server.py
+
+Used by the interpreters of Assignment2 and Assignment3 for --server. Keeps
+an interpreter running and answers requests, one JSON object per line, read
+from stdin (answers go to stdout) or from connections to a Unix socket. A
+request is {"id": ..., "program": "..."} plus optional limits and options
+for the interpreter; each answer is a single line
+{"id": ..., "result": "...", "seconds": ...} or, if the program failed or hit
+a limit, {"id": ..., "error": "...", "type": "...", "seconds": ...}. A failed
+request does not stop the server.
+
+"timeout" (seconds) is enforced with SIGALRM and so needs a Unix system; the
+requests are handled in the main thread for this reason.
+"""
+import json
+import os
+import signal
+import socket
+import stat
+import sys
+import time
+
+
+class TimeLimitExceeded(Exception):
+    pass
+
+
+def on_alarm(signum, frame):
+    raise TimeLimitExceeded("time limit exceeded")
+
+
+# run handle(request), raising TimeLimitExceeded after timeout seconds
+def with_time_limit(timeout, handle, request):
+    if not timeout or not hasattr(signal, "setitimer"):
+        return handle(request)
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return handle(request)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def answer(line, handle, defaults):
+    start = time.perf_counter()
+    response = {}
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict) or not isinstance(request.get("program"), str):
+            raise ValueError('a request needs a "program" string')
+        response["id"] = request.get("id")
+        request = dict(defaults, **request)
+        response["result"] = with_time_limit(request.get("timeout"), handle, request)
+    except Exception as e:
+        response["error"] = str(e)
+        response["type"] = type(e).__name__
+    response["seconds"] = time.perf_counter() - start
+    return response
+
+
+# handle(request) interprets request["program"] and returns the result;
+# defaults fill in whatever a request leaves out
+def serve(infile, outfile, handle, defaults):
+    for line in infile:
+        if not line.strip():
+            continue
+        outfile.write(json.dumps(answer(line, handle, defaults)) + "\n")
+        outfile.flush()
+
+
+# one connection at a time, each sending any number of requests. A socket
+# left at path by an earlier server is replaced; any other file is an error.
+def serve_socket(path, handle, defaults):
+    if os.path.lexists(path):
+        if not stat.S_ISSOCK(os.lstat(path).st_mode):
+            sys.exit(f"{path} exists and is not a socket")
+        os.remove(path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        listener.bind(path)
+        listener.listen()
+        while True:
+            connection, _ = listener.accept()
+            with connection, connection.makefile("r") as infile, connection.makefile("w") as outfile:
+                try:
+                    serve(infile, outfile, handle, defaults)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+    finally:
+        listener.close()
+        os.remove(path)
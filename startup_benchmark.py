@@ -0,0 +1,55 @@
+"""
+startup_benchmark.py
+
+Usage:
+    python startup_benchmark.py [--runs 10]
+
+Measures how long calculator_cfg.py and the two interpreters take to start,
+parse a tiny program and exit, each started as a new process from this
+directory. "cold" runs get an empty temp directory, so Lark has to build the
+LALR tables; "warm" runs share one, so the cached tables are loaded instead.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PROGRAMS = {
+    "calculator_cfg": (os.path.join(HERE, "Assignment1", "calculator_cfg.py"), "1+2*3"),
+    "Assignment2": (os.path.join(HERE, "Assignment2", "interpreter.py"), r"(\x.x) a"),
+    "Assignment3": (os.path.join(HERE, "Assignment3", "interpreter.py"), "1 + 2"),
+}
+
+
+def time_run(script, program, temp_dir):
+    env = dict(os.environ, TMPDIR=temp_dir)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, script, program], env=env, cwd=HERE,
+                   check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Process startup time of the three programs.")
+    arg_parser.add_argument("--runs", type=int, default=10)
+    args = arg_parser.parse_args()
+
+    print(f"{'program':<16} {'cold':>10} {'warm':>10}")
+    for name, (script, program) in PROGRAMS.items():
+        cold = []
+        for _ in range(args.runs):
+            with tempfile.TemporaryDirectory() as temp_dir:
+                cold.append(time_run(script, program, temp_dir))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            time_run(script, program, temp_dir)
+            warm = [time_run(script, program, temp_dir) for _ in range(args.runs)]
+        print(f"{name:<16} {statistics.median(cold) * 1000:7.1f} ms {statistics.median(warm) * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()